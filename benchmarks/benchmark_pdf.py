@@ -0,0 +1,76 @@
+"""
+Mide el tiempo medio de generación de un informe PDF con `soporte_pdf.generate_pdf`, y el de una
+generación de referencia sin la plantilla compartida: hoja de estilos, estilos de las tablas y logo
+(a su tamaño original) creados en cada informe, con las imágenes codificadas en ASCII85.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/benchmark_pdf.py [número de informes]
+
+La vivienda de ejemplo no tiene imágenes, para medir solo la construcción del documento.
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+from reportlab import rl_config
+from reportlab.platypus import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import src.soporte_pdf as spdf
+
+VIVIENDA = {
+    "tipo": "piso", "direccion": "Calle Delicias 1", "urls_imagenes": [], "codigo": 100000000,
+    "precio": 95000.0, "tamanio": 75, "habitaciones": 3, "banios": 1,
+    "puntuacion_banio": 3, "puntuacion_cocina": 4, "alquiler_predicho": 720.0,
+    "anunciante": "Particular", "contacto": "600000000",
+    "descripcion": "Piso exterior y luminoso, reformado, cerca del tranvía. " * 10,
+    "Coste Total": 109450.0, "Rentabilidad Bruta": 7.89, "Beneficio Antes de Impuestos": 5123.45,
+    "Rentabilidad Neta": 3.98, "Cuota Mensual Hipoteca": -320.41, "Cash Necesario Compra": 28500.0,
+    "Cash Total Compra y Reforma": 33500.0, "Beneficio Neto": 4352.1,
+    "Cashflow Antes de Impuestos": 2590.12, "Cashflow Después de Impuestos": 1818.77,
+    "ROCE": 25.01, "ROCE (Años)": 4.0, "Cash-on-Cash Return": 5.43, "COCR (Años)": 18.42,
+}
+
+
+class PlantillaSinOptimizar(spdf.PlantillaInforme):
+    # Logo leído del fichero original (1200x1200 px) en cada informe, sin reducirlo
+    def _cargar_logo(self, logo_path):
+        if not os.path.exists(logo_path):
+            return None
+        logo = Image(logo_path)
+        logo.drawHeight = self.LADO_LOGO
+        logo.drawWidth = self.LADO_LOGO
+        return logo
+
+
+def generar_referencia(data):
+    # Referencia: la plantilla se vuelve a crear para cada informe
+    buffer = BytesIO()
+    doc = spdf._crear_documento(buffer)
+    story = spdf._contenido_vivienda(data, PlantillaSinOptimizar())
+    doc.build(story, onFirstPage=spdf.add_page_elements, onLaterPages=spdf.add_page_elements)
+    return buffer
+
+
+def medir(generar, n):
+    generar(VIVIENDA)  # Calentamiento (fuentes, imports perezosos de ReportLab)
+    inicio = time.perf_counter()
+    for _ in range(n):
+        generar(VIVIENDA)
+    return (time.perf_counter() - inicio) / n
+
+
+def medir_referencia(n):
+    use_a85 = rl_config.useA85
+    rl_config.useA85 = 1
+    try:
+        return medir(generar_referencia, n)
+    finally:
+        rl_config.useA85 = use_a85
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'Referencia:':<22}{medir_referencia(n) * 1000:.2f} ms por informe ({n} informes)")
+    print(f"{'Plantilla compartida:':<22}{medir(spdf.generate_pdf, n) * 1000:.2f} ms por informe ({n} informes)")
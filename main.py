@@ -1,7 +1,9 @@
 import sys
 import math
 import time
-import ast
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError as FuturesTimeoutError
 from datetime import datetime
 
 import pandas as pd
@@ -21,10 +23,13 @@ from streamlit_javascript import st_javascript
 sys.path.append("../src")
 import src.soporte_rentabilidad as sr
 import src.soporte_mongo as sm
+import src.soporte_mongo_async as sma
 import src.soporte_texto as stxt
 import src.soporte_chatbot as sc
 import src.soporte_styles as ss
 import src.soporte_pdf as spdf
+import src.soporte_semantica as ssem
+import src.soporte_filtros as sfil
 
 # -------------------------------------------------------------------
 # Page configuration and theme options
@@ -48,33 +53,125 @@ st.markdown(ss.styles, unsafe_allow_html=True)
 # -------------------------------------------------------------------
 # Setup: MongoDB connection and presets
 # -------------------------------------------------------------------
-bd = sm.conectar_a_mongo("ProyectoRentabilidad")
+NOMBRE_BD = "ProyectoRentabilidad"
+bd = sm.conectar_a_mongo(NOMBRE_BD)
+# Heavy text/media fields are left out of the main table and fetched per listing on demand
+PROYECCION_VIVIENDAS = sm.proyeccion_sin_detalles({"_id": 0, "type": 0, "id": 0})
+PROYECCION_DISTRITOS = {"_id": 0, "properties.distrito": 1, "geometry": 1}
 PRESETS = stxt.PRESETS
+# Columns used by the Insights page
+COLUMNAS_INSIGHTS = [
+    "distrito", "tipo", "tamanio", "planta", "precio", "alquiler_predicho", "habitaciones", "banios",
+    "Rentabilidad Bruta"
+]
+HOUSEBOT_TOP_K = 20  # Matches kept per Housebot query, to page through
+HOUSEBOT_TIMEOUT = 45  # Seconds before a Housebot search is abandoned
+HOUSEBOT_INTERVALO_SONDEO = 0.25  # Seconds between status updates while a search runs
+HOUSEBOT_MAX_HILOS = 8
 
 # -------------------------------------------------------------------
 # Utility functions and callbacks
 # -------------------------------------------------------------------
-@st.cache_data
+@st.cache_resource
+def get_almacen_viviendas():
+    # Process-wide listings table, the field and value of its sync watermark and when it was
+    # last fully loaded (plus the district polygons fetched alongside it on a cold start)
+    return {"data": None, "campo_marca": "_id", "marca": None, "cargado": 0, "revision": 0, "distritos": None}
+
+@st.cache_resource
+def get_almacen_rentabilidad():
+    # Latest full-dataset metrics per (reduction, inputs) and the dataset version they belong
+    # to, so that after a sync only the changed listings are recomputed. Shared by every
+    # session: the lock guards each read and each store-and-evict sequence
+    return threading.Lock(), OrderedDict()
+
+@st.cache_resource
+def get_almacen_detalles():
+    # descripcion and image URLs by codigo, fetched in batches for the listings on screen
+    # and kept parsed in an LRU cache shared by every session
+    return sm.AlmacenDetalles(bd, "ventafinal")
+
+def cargar_colecciones_iniciales():
+    # Cold start: both collections are fetched concurrently (Motor), so the wait is the
+    # slowest fetch rather than the sum. Without Motor, or if it fails, load them one by one
+    try:
+        colecciones = sma.importar_colecciones_sync(NOMBRE_BD, {
+            "ventafinal": (sm.importar_en_lotes, sm.tabla_desde_documentos, {"proyeccion": PROYECCION_VIVIENDAS}),
+            "distritos": (load_poligonos_distritos, construir_poligonos_distritos, {"proyeccion": PROYECCION_DISTRITOS}),
+        })
+        return colecciones["ventafinal"], colecciones["distritos"]
+    except Exception as e:
+        print(f"Carga asíncrona no disponible, se cargan las colecciones una a una: {e}")
+        return sm.importar_con_snapshot(bd, "ventafinal", proyeccion=PROYECCION_VIVIENDAS), None
+
+@st.cache_resource(ttl=600, show_spinner=False)
 def load_data():
+    # Shared by every session and rerun (cache_data would hand each call its own unpickled
+    # copy): callers must treat the frame as read-only. Filtering with a mask copies only
+    # the selected rows; nothing may be written back into the shared frame
     try:
-        data = sm.importar_a_geodataframe(bd, "ventafinal")
-        if "geometry" in data.columns:
+        almacen = get_almacen_viviendas()
+        proyeccion = PROYECCION_VIVIENDAS
+        version_anterior = almacen["data"].attrs.get("version") if almacen["data"] is not None else None
+        sincronizacion = None
+        if almacen["data"] is None or time.time() - almacen["cargado"] > sm.MAX_EDAD_SNAPSHOT:
+            # Identifiers dropped after import are not transferred at all; lat/lon come
+            # straight from the coordinates while streaming the cursor. Warm starts read the
+            # local snapshot and only hit MongoDB again when the collection changes. Without a
+            # modification-time field, this periodic full load is what picks up edited listings
+            almacen["campo_marca"] = sm.elegir_campo_marca(bd, "ventafinal")
+            almacen["marca"] = sm.obtener_marca_agua(bd, "ventafinal", almacen["campo_marca"])
+            almacen["data"], distritos = cargar_colecciones_iniciales()
+            almacen["distritos"] = distritos if distritos is not None else almacen["distritos"]
+            almacen["cargado"] = time.time()
+            almacen["revision"] += 1
+        else:
+            # On cache expiry only the listings inserted, modified or removed since the last
+            # sync are fetched
+            almacen["data"], cambios, almacen["marca"] = sm.sincronizar_incremental(
+                bd, "ventafinal", almacen["data"], almacen["marca"], almacen["campo_marca"],
+                proyeccion=proyeccion
+            )
+            if any(cambios.values()):
+                get_almacen_detalles().invalidar(cambios["actualizados"] + cambios["eliminados"])
+                almacen["revision"] += 1
+                sincronizacion = {
+                    "desde": version_anterior,
+                    "cambiados": cambios["insertados"] + cambios["actualizados"],
+                    "eliminados": cambios["eliminados"],
+                }
+        data = almacen["data"]
+        if "geometry" in data.columns and "lat" not in data.columns:
             data["lat"] = data["geometry"].apply(lambda x: x.y if hasattr(x, "y") else None)
             data["lon"] = data["geometry"].apply(lambda x: x.x if hasattr(x, "x") else None)
-        if "urls_imagenes" in data.columns:
-            data["urls_imagenes"] = data["urls_imagenes"].apply(
-                lambda x: ast.literal_eval(x) if isinstance(x, str) else x
-            )
+        # Categoricals, bool and int8/float32 where lossless; kept for later incremental syncs
+        data = almacen["data"] = sm.compactar_tipos(data)
+        if not data.empty:
+            # Dataset version: part of the key of the profitability cache and the indexes. The
+            # revision also changes it when a sync only touched other columns
+            data.attrs["version"] = hash((
+                almacen["revision"],
+                int(pd.util.hash_pandas_object(data[["codigo", "precio", "alquiler_predicho"]]).sum())
+            ))
+            # What changed since the previous version, for the incremental profitability update
+            data.attrs["sincronizacion"] = sincronizacion
         return data
     except Exception as e:
         st.error(f"Error cargando datos de viviendas: {e}")
         return pd.DataFrame()
 
-def load_poligonos_distritos(bd, collection_name="distritos"):
+def load_poligonos_distritos(bd, collection_name="distritos", proyeccion=PROYECCION_DISTRITOS):
     try:
         # Get data from MongoDB
-        data = list(bd[collection_name].find())
+        data = list(bd[collection_name].find({}, proyeccion))
+    except Exception as e:
+        print(f"Error loading polygons: {e}")
+        return gpd.GeoDataFrame()
+    return construir_poligonos_distritos(data)
 
+def construir_poligonos_distritos(data):
+    # Builds the district GeoDataFrame from the raw documents (fetched sync or async)
+    try:
         # Lists to store processed data
         districts = []
         geometries = []
@@ -145,6 +242,35 @@ def convert_coords_to_float(coords):
         return float(coords)
     return [convert_coords_to_float(c) for c in coords]
 
+@st.cache_resource(show_spinner=False)
+def get_capa_distritos(_db):
+    # One-time preprocessing of the district layer, shared across sessions: a ready
+    # GeoJSON feature per district plus a centroid table for the labels
+    distritos = get_almacen_viviendas().get("distritos")
+    if distritos is None or distritos.empty:
+        distritos = sm.importar_con_snapshot(_db, "distritos", load_poligonos_distritos, proyeccion=PROYECCION_DISTRITOS)
+    if distritos.empty:
+        # Raising keeps a failed load out of the cache so the next rerun retries it
+        raise ValueError("No se pudieron cargar los polígonos de los distritos.")
+    features = {}
+    centroides = []
+    for _, row in distritos.iterrows():
+        try:
+            geom = mapping(row["geometry"])
+            if "coordinates" in geom:
+                geom["coordinates"] = convert_coords_to_float(geom["coordinates"])
+            features[row["distrito"]] = {
+                "type": "Feature",
+                "properties": {"distrito": row["distrito"]},
+                "geometry": geom
+            }
+            centroide = row["geometry"].centroid
+            centroides.append({"distrito": row["distrito"], "centroid_lat": centroide.y, "centroid_lon": centroide.x})
+        except Exception as e:
+            print(f"Error al procesar distrito {row['distrito']}: {e}")
+            continue
+    return features, pd.DataFrame(centroides, columns=["distrito", "centroid_lat", "centroid_lon"])
+
 def is_mobile():
     # Get user agent string
     user_agent = st_javascript("navigator.userAgent")  
@@ -188,11 +314,108 @@ def apply_preset(preset_name):
 def update_input(key):
     st.session_state.inputs[key] = st.session_state[f"{key}_input"]
 
+@st.cache_resource(max_entries=4, show_spinner=False)
+def calcular_rentabilidad_cacheada(_data, version_datos, reduccion_porcentaje, inputs_items):
+    # Metrics for the full dataset, computed once per (dataset version, reduction, inputs)
+    # and shared across reruns, pages and sessions. The frame is shared: never modify it in place.
+    # Each entry is a full-size frame, so only a few scenarios are kept
+    datos = _data
+    if reduccion_porcentaje:
+        # Shallow copy: only the replaced precio column is new, the rest is shared
+        datos = _data.copy(deep=False)
+        datos["precio"] = datos["precio"] * (1 - reduccion_porcentaje / 100)
+
+    clave = (reduccion_porcentaje, inputs_items)
+    lock, previos = get_almacen_rentabilidad()
+    with lock:
+        anterior = previos.get(clave)
+    sincronizacion = _data.attrs.get("sincronizacion")
+    if anterior is not None and sincronizacion and anterior[0] == sincronizacion["desde"]:
+        # Same scenario on the previous version: recompute only the listings the sync changed
+        resultados = sm.compactar_tipos(sr.actualizar_rentabilidad_incremental(
+            anterior[1],
+            datos[datos["codigo"].isin(sincronizacion["cambiados"])],
+            sincronizacion["eliminados"],
+            **dict(inputs_items)
+        ))
+    else:
+        resultados = sr.calcular_rentabilidad_inmobiliaria_wrapper(datos, **dict(inputs_items))
+
+    with lock:
+        previos[clave] = (version_datos, resultados)
+        previos.move_to_end(clave)
+        while len(previos) > 4:
+            previos.popitem(last=False)
+    return resultados
+
+def get_resultados_rentabilidad(data, filtered_data=None, aplicar_reduccion=None, reduccion_porcentaje=None, inputs=None):
+    # Serve the filtered subset from the cached full-dataset metrics
+    if aplicar_reduccion is None:
+        aplicar_reduccion = st.session_state.aplicar_reduccion
+    if reduccion_porcentaje is None:
+        reduccion_porcentaje = st.session_state.reduccion_porcentaje
+    if inputs is None:
+        inputs = st.session_state.inputs
+    resultados = calcular_rentabilidad_cacheada(
+        data,
+        data.attrs.get("version"),
+        reduccion_porcentaje if aplicar_reduccion else 0,
+        tuple(sorted(inputs.items()))
+    )
+    if filtered_data is None:
+        return resultados
+    # Keeps the cached order (descending Rentabilidad Bruta)
+    return resultados[resultados.index.isin(filtered_data.index)]
+
 def process_housebot_data(_data, aplicar_reduccion, reduccion_porcentaje, inputs):
-    filtered_data = _data.copy()
-    if aplicar_reduccion:
-        filtered_data["precio"] = filtered_data["precio"] * (1 - reduccion_porcentaje / 100)
-    return sr.calcular_rentabilidad_inmobiliaria_wrapper(filtered_data, **inputs)
+    return get_resultados_rentabilidad(_data, None, aplicar_reduccion, reduccion_porcentaje, inputs)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_indice_texto(_data, version_datos):
+    # Inverted keyword index for the Housebot, built once per dataset version
+    return sc.construir_indice_texto(con_descripciones(_data, version_datos))
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_indice_semantico(_data, version_datos):
+    # Description vectors for the Housebot, memory-mapped from disk and shared across sessions
+    return ssem.construir_indice_semantico(con_descripciones(_data, version_datos))
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_indice_filtros(_data, version_datos):
+    # Sorted columns and bitsets behind the page filters, plus the slider bounds
+    return sfil.construir_indice_filtros(_data)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_descripciones(_data, version_datos):
+    # Every description, aligned with the rows of _data: read once per dataset version, in one
+    # pass outside the details LRU cache, and shared by both Housebot indexes and the Datos
+    # completos table. A failed read raises, so neither this nor the indexes get cached
+    descripciones = get_almacen_detalles().leer_columna("descripcion")
+    return _data["codigo"].map(descripciones).fillna("")
+
+def con_descripciones(data, version_datos):
+    return data.assign(descripcion=get_descripciones(data, version_datos))
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def generar_pdf_cacheado(_row, codigo, version_datos, inputs_items, reduccion_porcentaje):
+    # PDF bytes per (codigo, dataset version, inputs, reduction), shared across reruns and
+    # sessions; a sync that changes the listing yields a new version and a fresh report
+    return spdf.generate_pdf(_row).getvalue()
+
+def get_pdf_vivienda(row, version_datos):
+    reduccion = st.session_state.reduccion_porcentaje if st.session_state.aplicar_reduccion else 0
+    return generar_pdf_cacheado(
+        row, row["codigo"], version_datos, tuple(sorted(st.session_state.inputs.items())), reduccion
+    )
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def generar_pdf_lote_cacheado(_resultados, codigos, version_datos, inputs_items, reduccion_porcentaje, como_zip):
+    # Batch report per (result set, dataset version, inputs, reduction, format)
+    resultados = get_almacen_detalles().completar(_resultados)
+    return spdf.generate_pdf_lote(resultados.to_dict("records"), como_zip=como_zip).getvalue()
+
+def solicitar_pdf(codigo):
+    st.session_state.pdf_solicitados.add(codigo)
 
 def handle_nav_change():
     if "navigation" in st.session_state:
@@ -476,27 +699,27 @@ def render_resultados(data):
         '<p style="color: #224094; font-size: 18px;">• Mostrando resultados ordenados <strong>de mayor a menor rentabilidad bruta</strong>.<br>• No se muestran propiedades que requieran de una reforma integral o casas de campo.</p>',
         unsafe_allow_html=True
     )
+    # Filter options, slider bounds and masks come from the per-version filter index
+    indice_filtros = get_indice_filtros(data, data.attrs.get("version"))
     col1, col2, col3 = st.columns([2,1,1])
     with col1:
         selected_distritos = st.multiselect(
             "Selecciona uno o más distritos",
-            options=data["distrito"].unique(),
-            default=list(data["distrito"].unique())
+            options=indice_filtros.opciones["distrito"],
+            default=indice_filtros.opciones["distrito"]
         )
     with col2:
         st.write("Características de vivienda:")
         precio_min, precio_max = st.slider(
             "Precio (€)",
-            int(data["precio"].min()),
-            int(data["precio"].max()),
-            (int(data["precio"].min()), int(data["precio"].max())),
+            *indice_filtros.limites["precio"],
+            indice_filtros.limites["precio"],
             help="Filtro sobre el precio original, sin reducciones."
         )
         metros_min, metros_max = st.slider(
             "Metros cuadrados",
-            int(data["tamanio"].min()),
-            int(data["tamanio"].max()),
-            (int(data["tamanio"].min()), int(data["tamanio"].max()))
+            *indice_filtros.limites["tamanio"],
+            indice_filtros.limites["tamanio"]
         )
     with col3:
         st.markdown("Estado de vivienda:")
@@ -508,22 +731,56 @@ def render_resultados(data):
             "Cocina", 0, 5, (1, 5),
             help="0 imagen no detectada, 1 muy malo y 5 perfecto estado."
         )
-    filtered_data = data[
-        (data["distrito"].isin(selected_distritos)) &
-        (data["tamanio"].between(metros_min, metros_max)) &
-        (data["precio"].between(precio_min, precio_max)) &
-        (data["puntuacion_banio"].between(estado_bano_min, estado_bano_max)) &
-        (data["puntuacion_cocina"].between(estado_cocina_min, estado_cocina_max))
-    ].dropna(subset=["lat", "lon"])
+    filtered_data = data[indice_filtros.filtrar(
+        {
+            "distrito": selected_distritos,
+            "tamanio": (metros_min, metros_max),
+            "precio": (precio_min, precio_max),
+            "puntuacion_banio": (estado_bano_min, estado_bano_max),
+            "puntuacion_cocina": (estado_cocina_min, estado_cocina_max),
+        },
+        no_nulos=["lat", "lon"]
+    )]
     st.write(f"**Total de resultados filtrados:** {len(filtered_data)}")
     if not filtered_data.empty:
-        if st.session_state.aplicar_reduccion:
-            filtered_data = filtered_data.copy()
-            filtered_data["precio"] = filtered_data["precio"] * (1 - st.session_state.reduccion_porcentaje / 100)
-        resultados_rentabilidad = sr.calcular_rentabilidad_inmobiliaria_wrapper(
-            filtered_data,
-            **st.session_state.inputs
-        )
+        resultados_rentabilidad = get_resultados_rentabilidad(data, filtered_data)
+        # Reports cover at most the top MAX_VIVIENDAS_LOTE results (descending Rentabilidad Bruta)
+        resultados_lote = resultados_rentabilidad.head(spdf.MAX_VIVIENDAS_LOTE)
+        with st.expander(f"📦 Informe de los {len(resultados_lote)} mejores resultados filtrados"):
+            if len(resultados_lote) < len(resultados_rentabilidad):
+                st.caption(
+                    f"El informe incluye las {spdf.MAX_VIVIENDAS_LOTE} viviendas de mayor rentabilidad bruta. "
+                    "Ajusta los filtros para elegir otras."
+                )
+            formato_lote = st.radio(
+                "Formato del informe",
+                ["Un único PDF", "ZIP con un PDF por vivienda"],
+                horizontal=True,
+                key="formato_informe_lote"
+            )
+            como_zip = formato_lote != "Un único PDF"
+            reduccion = st.session_state.reduccion_porcentaje if st.session_state.aplicar_reduccion else 0
+            clave_lote = (
+                tuple(resultados_lote["codigo"]),
+                data.attrs.get("version"),
+                tuple(sorted(st.session_state.inputs.items())),
+                reduccion,
+                como_zip
+            )
+            if st.session_state.get("informe_lote_solicitado") != clave_lote:
+                if st.button("Generar informe", key="generar_informe_lote"):
+                    st.session_state.informe_lote_solicitado = clave_lote
+                    st.rerun()
+            else:
+                with st.spinner("Generando informe..."):
+                    informe_lote = generar_pdf_lote_cacheado(resultados_lote, *clave_lote)
+                st.download_button(
+                    label="📄 Descargar informe",
+                    data=informe_lote,
+                    file_name="informe_viviendas.zip" if como_zip else "informe_viviendas.pdf",
+                    mime="application/zip" if como_zip else "application/pdf",
+                    key="download_informe_lote"
+                )
         results_per_page = 10
         total_pages = math.ceil(len(filtered_data) / results_per_page)
         st.markdown(ss.card_styles, unsafe_allow_html=True)
@@ -536,7 +793,7 @@ def render_resultados(data):
             )
         start_idx = (page_number - 1) * results_per_page
         end_idx = start_idx + results_per_page
-        paginated_data = resultados_rentabilidad.iloc[start_idx:end_idx]
+        paginated_data = get_almacen_detalles().completar(resultados_rentabilidad.iloc[start_idx:end_idx])
         for _, row in paginated_data.iterrows():
             image_urls = row["urls_imagenes"] if row["urls_imagenes"] else []
             rentabilidad_bruta = (
@@ -641,15 +898,23 @@ def render_resultados(data):
                 st.markdown("  \n")
                 col1_final, col2_final, col3_final = st.columns(3)
                 with col1_final:
-                    pdf_buffer = spdf.generate_pdf(row)
+                    # The report is only built once requested for this listing
                     unique_key = f"download_pdf_{row['direccion'].replace(' ', '_')}_{row.name}"
-                    st.download_button(
-                        label="📄 Descargar informe en PDF",
-                        data=pdf_buffer,
-                        file_name=f"detalles_vivienda_{row['direccion'].replace(' ', '_')}.pdf",
-                        mime="application/pdf",
-                        key=unique_key
-                    )
+                    if row["codigo"] not in st.session_state.pdf_solicitados:
+                        st.button(
+                            "📄 Generar informe en PDF",
+                            key=f"generar_{unique_key}",
+                            on_click=solicitar_pdf,
+                            args=(row["codigo"],)
+                        )
+                    else:
+                        st.download_button(
+                            label="📄 Descargar informe en PDF",
+                            data=get_pdf_vivienda(row, data.attrs.get("version")),
+                            file_name=f"detalles_vivienda_{row['direccion'].replace(' ', '_')}.pdf",
+                            mime="application/pdf",
+                            key=unique_key
+                        )
                 with col2_final:
                     st.link_button("🔗 Ver en Idealista", url=idealista_url)
                 with col3_final:
@@ -663,55 +928,45 @@ def render_resultados(data):
         st.write("No hay propiedades que coincidan con los filtros.")
 
 def render_mapa(data, db):
-    # Load district polygons using the improved function
-    distritos = load_poligonos_distritos(db)
-    
-    if distritos.empty:
-        st.error("No se pudieron cargar los polígonos de los distritos.")
+    # Preprocessed district layer (cached across sessions)
+    try:
+        features_distritos, centroides_distritos = get_capa_distritos(db)
+    except Exception as e:
+        st.error(f"No se pudieron cargar los polígonos de los distritos: {e}")
         return
     
     # UI Controls
+    indice_filtros = get_indice_filtros(data, data.attrs.get("version"))
     selected_distritos = st.multiselect(
         "Selecciona los distritos",
-        options=data["distrito"].unique(),
-        default=list(data["distrito"].unique())
+        options=indice_filtros.opciones["distrito"],
+        default=indice_filtros.opciones["distrito"]
     )
     
     col1, col2 = st.columns(2)
     with col1:
         precio_min, precio_max = st.slider(
             "Precio (€)",
-            int(data["precio"].min()),
-            int(data["precio"].max()),
-            (int(data["precio"].min()), int(data["precio"].max())),
+            *indice_filtros.limites["precio"],
+            indice_filtros.limites["precio"],
             help="Filtro sobre el precio original, sin reducciones."
         )
     with col2:
         metros_min, metros_max = st.slider(
             "Metros cuadrados",
-            int(data["tamanio"].min()),
-            int(data["tamanio"].max()),
-            (int(data["tamanio"].min()), int(data["tamanio"].max()))
+            *indice_filtros.limites["tamanio"],
+            indice_filtros.limites["tamanio"]
         )
 
     # Filter data based on user selection
-    filtered_data = data[
-        (data["distrito"].isin(selected_distritos)) &
-        (data["tamanio"].between(metros_min, metros_max)) &
-        (data["precio"].between(precio_min, precio_max))
-    ].dropna(subset=["lat", "lon"])
+    filtered_data = data[indice_filtros.filtrar(
+        {"distrito": selected_distritos, "tamanio": (metros_min, metros_max), "precio": (precio_min, precio_max)},
+        no_nulos=["lat", "lon"]
+    )]
 
     if not filtered_data.empty:
-        # Apply price reduction if enabled
-        if st.session_state.aplicar_reduccion:
-            filtered_data = filtered_data.copy()
-            filtered_data["precio"] = filtered_data["precio"] * (1 - st.session_state.reduccion_porcentaje / 100)
-        
-        # Calculate property metrics
-        resultados_rentabilidad = sr.calcular_rentabilidad_inmobiliaria_wrapper(
-            filtered_data,
-            **st.session_state.inputs
-        )
+        # Calculate property metrics (cached, price reduction already applied)
+        resultados_rentabilidad = get_resultados_rentabilidad(data, filtered_data)
 
         # Create the base figure
         fig = go.Figure()
@@ -741,32 +996,12 @@ def render_mapa(data, db):
             showlegend=False  # Hide "Propiedades" from the legend
         ))
 
-        # Filter and prepare district polygons
-        filtered_distritos = distritos[distritos["distrito"].isin(selected_distritos)]
-        features = []
-        distrito_hover_texts = []
-
-        for _, row in filtered_distritos.iterrows():
-            try:
-                geom = mapping(row["geometry"])
-                if "coordinates" in geom:
-                    geom["coordinates"] = convert_coords_to_float(geom["coordinates"])
-                features.append({
-                    "type": "Feature",
-                    "properties": {"distrito": row["distrito"]},
-                    "geometry": geom
-                })
-                distrito_hover_texts.append((row["geometry"].centroid.y, row["geometry"].centroid.x, row["distrito"]))
-            except Exception as e:
-                st.warning(f"Error al procesar distrito {row['distrito']}: {e}")
-                continue
-
-        geojson_distritos = {"type": "FeatureCollection", "features": features}
-
-        # Calculate centroids for district labels
-        filtered_distritos["centroid"] = filtered_distritos["geometry"].centroid
-        filtered_distritos["centroid_lat"] = filtered_distritos["centroid"].apply(lambda p: p.y)
-        filtered_distritos["centroid_lon"] = filtered_distritos["centroid"].apply(lambda p: p.x)
+        # Select the preprocessed district polygons and labels
+        geojson_distritos = {
+            "type": "FeatureCollection",
+            "features": [features_distritos[d] for d in selected_distritos if d in features_distritos]
+        }
+        filtered_distritos = centroides_distritos[centroides_distritos["distrito"].isin(selected_distritos)]
 
         # Add Scattermapbox trace for district labels
         fig.add_trace(go.Scattermapbox(
@@ -843,28 +1078,135 @@ def render_housebot(data):
         unsafe_allow_html=True
     )
     if user_query:
-        if st.session_state.query_result is None or user_query != st.session_state.last_query:
-            with st.spinner("🔍 Buscando la vivienda que mejor se ajuste a tu búsqueda..."):
-                st.session_state.last_query = user_query
-                chat_response = sc.chatbot_query(st.session_state.housebot_df, user_query)
-                best_property = sc.find_best_match(st.session_state.housebot_df, chat_response)
-                st.session_state.query_result = best_property
-        if isinstance(st.session_state.query_result, str):
-            st.write(st.session_state.query_result)
+        busqueda = st.session_state.get("housebot_busqueda")
+        if busqueda is not None and busqueda["consulta"] != user_query:
+            # Superseded by an edit, even one back to the query already answered: its ranking
+            # must never be stored as the answer to user_query
+            cancelar_busqueda_housebot(busqueda)
+            busqueda = None
+        if busqueda is None and (
+            st.session_state.query_result is None or user_query != st.session_state.get("last_query")
+        ):
+            busqueda = lanzar_busqueda_housebot(data, user_query)
+        if busqueda is not None:
+            ranking = esperar_busqueda_housebot(busqueda)
+            if ranking is None:
+                return
+            # Ranking of the best matches, kept in the session so paging does not re-query.
+            # The finished search is dropped, so later reruns do not reset the page
+            st.session_state.query_result = ranking
+            st.session_state.last_query = user_query
+            st.session_state.housebot_pagina = 0
+            st.session_state.housebot_busqueda = None
+        ranking = st.session_state.query_result
+        if ranking.empty:
+            st.write("No se han encontrado viviendas con ese criterio.")
         else:
-            sc.display_property_details(st.session_state.query_result)
+            if ranking["relevancia"].iloc[0] < 1:
+                st.info("No hay viviendas que cumplan todos los criterios, te mostramos las más parecidas.")
+            pagina = min(st.session_state.housebot_pagina, len(ranking) - 1)
+            col_anterior, col_posicion, col_siguiente = st.columns([1, 2, 1])
+            col_anterior.button(
+                "⬅️ Anterior",
+                disabled=pagina == 0,
+                on_click=cambiar_pagina_housebot,
+                args=(-1,),
+                use_container_width=True
+            )
+            col_posicion.markdown(
+                f"<div style='text-align: center;'>Vivienda {pagina + 1} de {len(ranking)} · "
+                f"coincidencia {ranking['relevancia'].iloc[pagina]:.0%}</div>",
+                unsafe_allow_html=True
+            )
+            col_siguiente.button(
+                "Siguiente ➡️",
+                disabled=pagina == len(ranking) - 1,
+                on_click=cambiar_pagina_housebot,
+                args=(1,),
+                use_container_width=True
+            )
+            vivienda = get_almacen_detalles().completar(ranking.iloc[[pagina]])
+            sc.display_property_details(vivienda.iloc[0].to_dict())
+
+def cambiar_pagina_housebot(paso):
+    st.session_state.housebot_pagina += paso
+
+@st.cache_resource(show_spinner=False)
+def get_executor_housebot():
+    # Worker threads shared by all sessions: the script thread only polls, so editing the
+    # query interrupts the wait instead of sitting behind a blocking OpenAI call
+    return ThreadPoolExecutor(max_workers=HOUSEBOT_MAX_HILOS, thread_name_prefix="housebot")
+
+def cancelar_busqueda_housebot(busqueda):
+    # Abandon a superseded search: it is cancelled if not started yet, or stops (and its
+    # result is discarded) at the end of its current stage
+    busqueda["cancelacion"].set()
+    busqueda["futuro"].cancel()
+    if st.session_state.get("housebot_busqueda") is busqueda:
+        st.session_state.housebot_busqueda = None
+
+def lanzar_busqueda_housebot(data, user_query):
+    anterior = st.session_state.get("housebot_busqueda")
+    if anterior is not None:
+        cancelar_busqueda_housebot(anterior)
+
+    # Cached resources are resolved here: worker threads must not call Streamlit. Without the
+    # descriptions the search still runs, on the structured columns only
+    try:
+        indice_texto = get_indice_texto(data, data.attrs.get("version"))
+        indice_semantico = get_indice_semantico(data, data.attrs.get("version"))
+    except Exception as e:
+        print(f"Índices del Housebot no disponibles, se busca sin descripciones: {e}")
+        indice_texto, indice_semantico = None, None
+    busqueda = {
+        "consulta": user_query,
+        "cancelacion": threading.Event(),
+        "estado": {"etapa": "En cola"},
+        "inicio": time.monotonic(),
+    }
+    busqueda["futuro"] = get_executor_housebot().submit(
+        sc.ejecutar_busqueda,
+        st.session_state.housebot_df,
+        user_query,
+        HOUSEBOT_TOP_K,
+        indice_texto,
+        indice_semantico,
+        busqueda["cancelacion"],
+        busqueda["estado"]
+    )
+    st.session_state.housebot_busqueda = busqueda
+    return busqueda
+
+def esperar_busqueda_housebot(busqueda):
+    # Polls the search, streaming its current stage. Every poll goes through Streamlit, so a
+    # rerun (the user edited the query) interrupts the wait right away
+    estado = st.empty()
+    try:
+        while True:
+            try:
+                return busqueda["futuro"].result(timeout=HOUSEBOT_INTERVALO_SONDEO)
+            except FuturesTimeoutError:
+                transcurrido = time.monotonic() - busqueda["inicio"]
+                if transcurrido > HOUSEBOT_TIMEOUT:
+                    busqueda["cancelacion"].set()
+                    st.session_state.housebot_busqueda = None
+                    st.error("⏱️ La búsqueda está tardando demasiado. Inténtalo de nuevo en unos segundos.")
+                    return None
+                estado.info(f"🔍 {busqueda['estado']['etapa']}... ({transcurrido:.0f} s)")
+    except (sc.BusquedaCancelada, CancelledError):
+        return None
+    except Exception as e:
+        st.error(f"No se ha podido completar la búsqueda: {e}")
+        return None
+    finally:
+        if st.session_state.get("housebot_busqueda") is busqueda and busqueda["futuro"].done():
+            st.session_state.housebot_busqueda = None
+        estado.empty()
 
 def render_insights(data):
     st.header("💡 Insights Inmobiliarios")
 
-    filtered_data = data
-    if st.session_state.aplicar_reduccion:
-        filtered_data = filtered_data.copy()
-        filtered_data["precio"] = filtered_data["precio"] * (1 - st.session_state.reduccion_porcentaje / 100)
-    df = sr.calcular_rentabilidad_inmobiliaria_wrapper(
-        filtered_data,
-        **st.session_state.inputs
-    )
+    df = get_resultados_rentabilidad(data)
 
     # Filtros en la página principal
     tab1, tab2 = st.tabs(["Datos", "Sobre estos datos"])
@@ -886,21 +1228,23 @@ def render_insights(data):
             default=["piso", "estudio", "ático"]
         )
 
-        # Filtrar el DataFrame según los distritos y tipo seleccionados
-        df_filtrado = df[
+        # Filtrar el DataFrame según los distritos y tipo seleccionados, eliminando filas donde el
+        # tamaño ("tamanio") no sea positivo para evitar errores. Solo se toman las columnas que
+        # usa esta página, no la tabla completa
+        df_filtrado = df.loc[
             (df["distrito"].isin(distritos_seleccionados)) &
-            (df["tipo"].isin(tipos_seleccionados))
-        ].copy()
-
-        # Eliminar filas donde el tamaño ("tamanio") no sea positivo para evitar errores
-        df_filtrado = df_filtrado[df_filtrado["tamanio"] > 0]
-
-        # Convertir la columna "planta" a numérico, convirtiendo a NaN los valores no convertibles
-        df_filtrado["planta"] = pd.to_numeric(df_filtrado["planta"], errors="coerce")
+            (df["tipo"].isin(tipos_seleccionados)) &
+            (df["tamanio"] > 0),
+            COLUMNAS_INSIGHTS
+        ]
 
-        # Crear columnas adicionales para el análisis
-        df_filtrado["alquiler_por_m2"] = df_filtrado["alquiler_predicho"] / df_filtrado["tamanio"]
-        df_filtrado["precio_por_m2"] = df_filtrado["precio"] / df_filtrado["tamanio"]
+        # Convertir la columna "planta" a numérico, convirtiendo a NaN los valores no convertibles,
+        # y crear columnas adicionales para el análisis
+        df_filtrado = df_filtrado.assign(
+            planta=pd.to_numeric(df_filtrado["planta"], errors="coerce"),
+            alquiler_por_m2=df_filtrado["alquiler_predicho"] / df_filtrado["tamanio"],
+            precio_por_m2=df_filtrado["precio"] / df_filtrado["tamanio"]
+        )
 
         # Sección de Métricas Clave
         st.write("### 📈 Métricas Clave")
@@ -937,7 +1281,7 @@ def render_insights(data):
         st.write("### 📊 Visualizaciones")
         if not df_filtrado.empty:
             # Agrupar por distrito para calcular las medianas
-            df_agrupado = df_filtrado.groupby("distrito").agg({
+            df_agrupado = df_filtrado.groupby("distrito", observed=True).agg({
                 "alquiler_por_m2": "mean",
                 "precio_por_m2": "mean"
             }).reset_index()
@@ -981,7 +1325,7 @@ def render_insights(data):
             
             # Gráfico 4: Rentabilidad Bruta Promedio por Tipo y Distrito (visualización simplificada)
             if "Rentabilidad Bruta" in df_filtrado.columns:
-                df_rentabilidad = df_filtrado.groupby(["tipo", "distrito"]).agg({"Rentabilidad Bruta": "mean"}).reset_index()
+                df_rentabilidad = df_filtrado.groupby(["tipo", "distrito"], observed=True).agg({"Rentabilidad Bruta": "mean"}).reset_index()
                 fig_rent = px.bar(
                     df_rentabilidad,
                     x="tipo",
@@ -1016,45 +1360,39 @@ def render_datos_completos(data):
         "• Los resultados se muestran en orden de Rentabilidad Bruta descendiente.</p>",
         unsafe_allow_html=True
     )
+    indice_filtros = get_indice_filtros(data, data.attrs.get("version"))
     selected_distritos = st.multiselect(
         "Selecciona distritos",
-        options=data["distrito"].unique(),
-        default=list(data["distrito"].unique()),
+        options=indice_filtros.opciones["distrito"],
+        default=indice_filtros.opciones["distrito"],
         key="distrito_filtro"
     )
     col1, col2 = st.columns(2)
     with col1:
         precio_min, precio_max = st.slider(
             "Precio (€)",
-            int(data["precio"].min()),
-            int(data["precio"].max()),
-            (int(data["precio"].min()), int(data["precio"].max())),
+            *indice_filtros.limites["precio"],
+            indice_filtros.limites["precio"],
             key="precio_filtro",
             help="Filtro sobre el precio original, sin reducciones."
         )
     with col2:
         metros_min, metros_max = st.slider(
             "Metros cuadrados",
-            int(data["tamanio"].min()),
-            int(data["tamanio"].max()),
-            (int(data["tamanio"].min()), int(data["tamanio"].max())),
+            *indice_filtros.limites["tamanio"],
+            indice_filtros.limites["tamanio"],
             key="metros_filtro"
         )
-    filtered_data = data[
-        (data["distrito"].isin(selected_distritos)) &
-        (data["tamanio"].between(metros_min, metros_max)) &
-        (data["precio"].between(precio_min, precio_max))
-    ]
+    filtered_data = data[indice_filtros.filtrar(
+        {"distrito": selected_distritos, "tamanio": (metros_min, metros_max), "precio": (precio_min, precio_max)}
+    )]
     if not filtered_data.empty:
-        if st.session_state.aplicar_reduccion:
-            filtered_data = filtered_data.copy()
-            filtered_data["precio"] = filtered_data["precio"] * (1 - st.session_state.reduccion_porcentaje / 100)
-        resultados_rentabilidad = sr.calcular_rentabilidad_inmobiliaria_wrapper(
-            filtered_data,
-            **st.session_state.inputs
-        )
+        resultados_rentabilidad = get_resultados_rentabilidad(data, filtered_data)
         exclude_columns = {"lat", "lon", "urls_imagenes", "url_cocina", "url_banio", "estado", "geometry"}
         available_columns = [col for col in resultados_rentabilidad.columns if col not in exclude_columns]
+        # Descriptions are not kept in the main table: offered here and joined only when selected
+        if "descripcion" not in available_columns:
+            available_columns.append("descripcion")
         default_columns = ["distrito", "direccion", "tipo", "precio", "tamanio", "habitaciones", "banios", "Rentabilidad Bruta"]
         default_columns = [col for col in default_columns if col in available_columns]
         selected_columns = st.multiselect(
@@ -1065,6 +1403,16 @@ def render_datos_completos(data):
         )
         if "Rentabilidad Bruta" in resultados_rentabilidad.columns:
             resultados_rentabilidad = resultados_rentabilidad.sort_values(by="Rentabilidad Bruta", ascending=False)
+        if "descripcion" in selected_columns:
+            try:
+                descripciones = get_descripciones(data, data.attrs.get("version"))
+            except Exception as e:
+                print(f"No se pudieron leer las descripciones: {e}")
+                st.warning("Las descripciones no están disponibles en este momento.")
+                descripciones = pd.Series("", index=data.index)
+            resultados_rentabilidad = resultados_rentabilidad.assign(
+                descripcion=descripciones.reindex(resultados_rentabilidad.index).fillna("")
+            )
         st.dataframe(resultados_rentabilidad[selected_columns])
     else:
         st.write("No hay datos que coincidan con los filtros.")
@@ -1093,6 +1441,7 @@ def main():
     st.session_state.setdefault("aplicar_reduccion", True)
     st.session_state.setdefault("reduccion_porcentaje", 10)
     st.session_state.setdefault("loading", False)
+    st.session_state.setdefault("pdf_solicitados", set())
 
     data = load_data()
 
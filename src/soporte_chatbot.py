@@ -3,6 +3,15 @@ import openai
 from dotenv import load_dotenv
 import os
 import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
 import folium
 import ast
 from streamlit_folium import st_folium
@@ -13,6 +22,7 @@ OPENAI = os.getenv("OPENAI")
 if not OPENAI:
     raise ValueError("OPENAI no está definido en las variables de entorno")
 client = openai.OpenAI(api_key=OPENAI) 
+TIMEOUT_LLM = 20  # Seconds per OpenAI request
 
 
 def render_image_carousel(image_urls):
@@ -66,10 +76,402 @@ VALID_COLUMNS = [
     "aire_acondicionado", "trastero", "terraza", "patio", "parking", "direccion", "distrito"
 ]
 
+# Range criteria (e.g. 'precio_max') accepted on top of the exact columns
+RANGE_COLUMNS = ["precio", "tamanio", "habitaciones", "banios"]
+VALID_RANGE_KEYS = [f"{col}_{limite}" for col in RANGE_COLUMNS for limite in ("min", "max")]
+
+
+# -------------------------------------------------------------------
+# Local query parser (no network): handles the common queries before calling the LLM
+# -------------------------------------------------------------------
+_NUM = r"\d+(?:[.,]\d+)*"
+_MULT = r"mil|k|millones|millon"
+_UNIDADES = {
+    "habitaciones": r"habitacion(?:es)?|dormitorios?|cuartos?|habs?",
+    "banios": r"banos?",
+    "tamanio": r"m2|metros cuadrados|metros|mts?",
+    "precio": r"€|euros?|eur",
+}
+_UNIDAD = "|".join(f"(?P<{campo}>{patron})" for campo, patron in _UNIDADES.items())
+_COMP_MAX = r"menos de|por debajo de|inferior a|hasta|como maximo|maximo|no mas de|menor de|menor que|por menos de"
+_COMP_MIN = r"mas de|por encima de|superior a|al menos|como minimo|minimo|desde|mayor de|mayor que|a partir de"
+
+_PATRON_RANGO = re.compile(
+    rf"entre\s+(?P<a>{_NUM})(?:\s*(?P<mult_a>{_MULT})(?!\w))?\s*(?:(?:{_UNIDAD.replace('?P<', '?P<a_')})(?!\w))?"
+    rf"\s+y\s+(?P<b>{_NUM})(?:\s*(?P<mult_b>{_MULT})(?!\w))?\s*(?:(?:{_UNIDAD})(?!\w))?"
+)
+_PATRON_NUMERO = re.compile(
+    rf"(?:(?P<comp_max>{_COMP_MAX})\s+|(?P<comp_min>{_COMP_MIN})\s+)?(?P<num>{_NUM})"
+    rf"(?:\s*(?P<mult>{_MULT})(?!\w))?\s*(?:(?:{_UNIDAD})(?!\w))?(?P<o_mas>\s+o\s+mas)?"
+)
+
+_NUMEROS_PALABRAS = {
+    "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10
+}
+_ORDINALES = {
+    "primer": 1, "primera": 1, "primero": 1, "segunda": 2, "segundo": 2, "tercer": 3, "tercera": 3,
+    "tercero": 3, "cuarta": 4, "cuarto": 4, "quinta": 5, "quinto": 5, "sexta": 6, "sexto": 6,
+    "septima": 7, "septimo": 7, "octava": 8, "octavo": 8, "novena": 9, "noveno": 9,
+    "decima": 10, "decimo": 10
+}
+_TIPOS = {
+    "piso": r"pisos?", "ático": r"aticos?", "estudio": r"estudios?", "dúplex": r"duplex",
+    "apartamento": r"apartamentos?", "chalet": r"chalets?", "casa": r"casas?"
+}
+_AMENIDADES = {
+    "ascensor": r"ascensor",
+    "terraza": r"terrazas?",
+    "patio": r"patios?",
+    "trastero": r"trasteros?",
+    "parking": r"parking|garaje|plaza de garaje|aparcamiento",
+    # Not bare 'aire': 'al aire libre' is not air conditioning
+    "aire_acondicionado": r"aire acondicionado|climatizacion|climatizad[oa]",
+    "exterior": r"exterior",
+}
+_NEGACION = r"(?:sin|no\s+(?:tenga|tiene|quiero|necesito|con)?\s*(?:un|una|el|la)?)\s+"
+
+# Words that carry no search criteria: a query made only of criteria and these words is fully parsed
+_PALABRAS_VACIAS = set("""
+    quiero queria busco buscando buscar necesito me gustaria encontrar encuentrame dame hay algun alguna
+    un una unos unas el la los las lo de del en con y e o a al que tenga tengan tiene tienen para por
+    vivienda viviendas inmueble inmuebles propiedad zona barrio distrito precio tamano superficie
+    cerca mas menos muy por favor gracias hola mi nos sea este esta planta euros
+""".split())
+
+
+def normalizar_texto(texto):
+    """Lowercase, strip accents and collapse whitespace."""
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = texto.replace("m²", "m2").replace("-", " ")
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+def _a_numero(texto, mult=None):
+    # '100.000' / '100,000' are thousands; '1,5' / '1.5' are decimals
+    if re.fullmatch(r"\d{1,3}(?:[.,]\d{3})+", texto):
+        valor = float(re.sub(r"[.,]", "", texto))
+    else:
+        valor = float(texto.replace(",", "."))
+    if mult in ("mil", "k"):
+        valor *= 1000
+    elif mult in ("millon", "millones"):
+        valor *= 1000000
+    return int(valor) if valor.is_integer() else valor
+
+
+def _campo_unidad(match, prefijo=""):
+    for campo in _UNIDADES:
+        if match.group(f"{prefijo}{campo}"):
+            return campo
+    return None
+
+
+def parsear_consulta(user_input, distritos=()):
+    """
+    Parses a Housebot query locally, without calling the LLM. Understands districts, property
+    types, floors, numeric values and ranges ('_min' / '_max') and amenities, including negations
+    ('sin ascensor').
+
+    Args:
+        user_input (str): User query.
+        distritos (iterable): District names present in the data.
+
+    Returns:
+        tuple[dict, bool]: The criteria (same keys as `chatbot_query`) and whether the whole query
+        was understood. If not, the LLM should be used for the remaining information.
+    """
+    texto = " " + normalizar_texto(user_input) + " "
+    criterios = {}
+
+    def consumir(match):
+        # Remove the matched span so it does not count as unparsed text
+        nonlocal texto
+        texto = texto[:match.start()] + " " * (match.end() - match.start()) + texto[match.end():]
+
+    # Numbers written as words ("dos habitaciones", "un baño")
+    texto = re.sub(r"\b(un|una)\s+(?=(?:habitacion|dormitorio|bano)\b)", "1 ", texto)
+    texto = re.sub(
+        r"\b(" + "|".join(_NUMEROS_PALABRAS) + r")\b",
+        lambda m: str(_NUMEROS_PALABRAS[m.group(1)]),
+        texto
+    )
+
+    # Districts (longest names first, so 'San José' wins over a shorter overlapping name)
+    for distrito in sorted({d for d in distritos if isinstance(d, str)}, key=len, reverse=True):
+        match = re.search(rf"\b{re.escape(normalizar_texto(distrito))}\b", texto)
+        if match:
+            criterios.setdefault("distrito", distrito)
+            consumir(match)
+
+    # Floor
+    for patron in (rf"\bplanta\s+(?P<n>\d+)\b", rf"\b(?P<ord>{'|'.join(_ORDINALES)})\s+planta\b", r"\b(?:un\s+)?bajo\b"):
+        match = re.search(patron, texto)
+        if match:
+            if "n" in match.groupdict():
+                criterios["planta"] = int(match.group("n"))
+            elif "ord" in match.groupdict():
+                criterios["planta"] = _ORDINALES[match.group("ord")]
+            else:
+                criterios["planta"] = 0
+            consumir(match)
+            break
+
+    # Amenities, with negation ('sin terraza') and 'interior' as the opposite of 'exterior'
+    for campo, patron in _AMENIDADES.items():
+        match = re.search(rf"(?P<neg>{_NEGACION})?\b(?:{patron})\b", texto)
+        if match:
+            criterios[campo] = not match.group("neg")
+            consumir(match)
+    match = re.search(r"\binterior\b", texto)
+    if match and "exterior" not in criterios:
+        criterios["exterior"] = False
+        consumir(match)
+
+    # Property type
+    for tipo, patron in _TIPOS.items():
+        match = re.search(rf"\b(?:{patron})\b", texto)
+        if match:
+            criterios.setdefault("tipo", tipo)
+            consumir(match)
+
+    # Ranges: 'entre 80 y 100 metros'
+    for match in list(_PATRON_RANGO.finditer(texto)):
+        campo = _campo_unidad(match) or _campo_unidad(match, "a_")
+        a = _a_numero(match.group("a"), match.group("mult_a") or match.group("mult_b"))
+        b = _a_numero(match.group("b"), match.group("mult_b"))
+        if campo is None and min(a, b) >= 10000:
+            campo = "precio"
+        if campo:
+            criterios[f"{campo}_min"], criterios[f"{campo}_max"] = min(a, b), max(a, b)
+            consumir(match)
+
+    # Single values: '3 habitaciones', 'menos de 100.000 euros', 'más de 80 m2', '2 baños o más'
+    for match in list(_PATRON_NUMERO.finditer(texto)):
+        valor = _a_numero(match.group("num"), match.group("mult"))
+        campo = _campo_unidad(match)
+        if campo is None and valor >= 10000:
+            campo = "precio"
+        if campo is None:
+            continue
+        if match.group("comp_max"):
+            criterios[f"{campo}_max"] = valor
+        elif match.group("comp_min") or match.group("o_mas"):
+            criterios[f"{campo}_min"] = valor
+        elif campo in ("habitaciones", "banios"):
+            criterios[campo] = valor
+        elif campo == "precio":
+            # A bare price is a budget
+            criterios["precio_max"] = valor
+        else:
+            criterios["tamanio_min"] = valor
+        consumir(match)
+
+    restantes = [palabra for palabra in re.findall(r"[a-z0-9€]+", texto) if palabra not in _PALABRAS_VACIAS]
+    completa = bool(criterios) and not restantes
+    return criterios, completa
+
+
+def _filtrar_criterios(criterios):
+    # Keep only known columns and range keys
+    return {k: v for k, v in criterios.items() if k in VALID_COLUMNS or k in VALID_RANGE_KEYS}
+
+
+# -------------------------------------------------------------------
+# Query cache: the same phrasings are repeated across sessions, so the validated criteria are
+# kept in memory and in SQLite, keyed by the normalized query
+# -------------------------------------------------------------------
+# Bump when the parser or the LLM prompt changes, so stale criteria are not served
+VERSION_CACHE_CONSULTAS = 2
+ruta_cache_consultas = os.getenv("query_cache_path", "cache_consultas.sqlite3")
+
+
+def clave_consulta(user_input):
+    """
+    Normalized form of a query used as cache key: case, accents, punctuation, whitespace and
+    number formats ('120.000 €', '120000 euros' and '120k €' give the same key).
+    """
+    texto = normalizar_texto(user_input).replace("€", " euros ")
+    texto = re.sub(
+        rf"(?P<num>{_NUM})(?:\s*(?P<mult>{_MULT})(?!\w))?",
+        lambda m: str(_a_numero(m.group("num"), m.group("mult"))),
+        texto
+    )
+    texto = re.sub(r"\beuro\b|\beur\b", "euros", texto)
+    texto = re.sub(r"[^a-z0-9.\s]|(?<!\d)\.|\.(?!\d)", " ", texto)
+    return f"v{VERSION_CACHE_CONSULTAS}:" + re.sub(r"\s+", " ", texto).strip()
+
+
+class CacheConsultas:
+    """
+    Two-level cache (LRU in memory + SQLite on disk) of query criteria, with expiration (TTL),
+    a maximum number of entries and hit/miss counters. Safe to share between Streamlit sessions.
+    """
+
+    def __init__(self, ruta=None, ttl=7 * 24 * 3600, max_entradas=5000, max_memoria=512):
+        self.ruta = ruta or ruta_cache_consultas
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_memoria = max_memoria
+        self.aciertos = 0
+        self.fallos = 0
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._conexion = None
+
+    def _get_conexion(self):
+        if self._conexion is None:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS consultas ("
+                "clave TEXT PRIMARY KEY, criterios TEXT NOT NULL, creado REAL NOT NULL, usado REAL NOT NULL)"
+            )
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_consultas_usado ON consultas (usado)")
+            self._conexion.commit()
+        return self._conexion
+
+    def _guardar_en_memoria(self, clave, creado, criterios):
+        self._memoria[clave] = (creado, criterios)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def obtener(self, user_input):
+        """Returns the cached criteria for the query, or None if missing or expired."""
+        clave = clave_consulta(user_input)
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is None:
+                try:
+                    fila = self._get_conexion().execute(
+                        "SELECT creado, criterios FROM consultas WHERE clave = ?", (clave,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"No se pudo leer la caché de consultas: {e}")
+                    fila = None
+                if fila is not None:
+                    entrada = (fila[0], json.loads(fila[1]))
+
+            if entrada is None or ahora - entrada[0] > self.ttl:
+                if entrada is not None:
+                    self._memoria.pop(clave, None)
+                    self._ejecutar("DELETE FROM consultas WHERE clave = ?", (clave,))
+                self.fallos += 1
+                return None
+
+            self._guardar_en_memoria(clave, *entrada)
+            self._ejecutar("UPDATE consultas SET usado = ? WHERE clave = ?", (ahora, clave))
+            self.aciertos += 1
+            return dict(entrada[1])
+
+    def guardar(self, user_input, criterios):
+        """Stores the criteria for the query, evicting expired and least recently used entries."""
+        clave = clave_consulta(user_input)
+        ahora = time.time()
+        with self._lock:
+            self._guardar_en_memoria(clave, ahora, dict(criterios))
+            self._ejecutar(
+                "INSERT OR REPLACE INTO consultas (clave, criterios, creado, usado) VALUES (?, ?, ?, ?)",
+                (clave, json.dumps(criterios, ensure_ascii=False), ahora, ahora)
+            )
+            self._ejecutar("DELETE FROM consultas WHERE creado < ?", (ahora - self.ttl,))
+            self._ejecutar(
+                "DELETE FROM consultas WHERE clave IN ("
+                "SELECT clave FROM consultas ORDER BY usado DESC LIMIT -1 OFFSET ?)",
+                (self.max_entradas,)
+            )
+
+    def _ejecutar(self, sql, parametros):
+        # The disk level is best effort: if SQLite fails the in-memory cache keeps working
+        try:
+            conexion = self._get_conexion()
+            conexion.execute(sql, parametros)
+            conexion.commit()
+        except sqlite3.Error as e:
+            print(f"No se pudo actualizar la caché de consultas: {e}")
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: Hits, misses, hit rate and number of stored entries.
+        """
+        with self._lock:
+            total = self.aciertos + self.fallos
+            try:
+                entradas = self._get_conexion().execute("SELECT COUNT(*) FROM consultas").fetchone()[0]
+            except sqlite3.Error:
+                entradas = len(self._memoria)
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": self.aciertos / total if total else 0.0,
+                "entradas": entradas,
+            }
+
+    def limpiar(self):
+        """Empties both cache levels and resets the counters."""
+        with self._lock:
+            self._memoria.clear()
+            self._ejecutar("DELETE FROM consultas", ())
+            self.aciertos = self.fallos = 0
+
+
+cache_consultas = CacheConsultas()
+
+
+# Criteria used when nothing could be extracted from a query
+CRITERIOS_POR_DEFECTO = {"tipo": "piso"}
+
+
 # Chatbot Query Function
 def chatbot_query(df, user_input):
+    criterios = cache_consultas.obtener(user_input)
+    if criterios is None:
+        criterios, definitivos = _interpretar_consulta(df, user_input)
+        # Fallbacks (LLM down, unreadable or empty answer) are not cached: the next try may do better
+        if definitivos:
+            cache_consultas.guardar(user_input, criterios)
+    return criterios
+
+
+def _interpretar_consulta(df, user_input):
+    # Returns (criteria, whether they are a real interpretation worth caching).
+    # Try the local parser first: most queries are answered without calling the LLM
+    distritos = df["distrito"].dropna().unique() if "distrito" in df.columns else ()
+    criterios_locales, completa = parsear_consulta(user_input, distritos)
+    if completa:
+        return criterios_locales, True
+
+    try:
+        structured_response = consulta_llm(user_input)
+    except Exception as e:
+        if not criterios_locales:
+            raise
+        # Offline or failing LLM: search with what the local parser understood
+        print(f"No se pudo consultar el LLM, se usan los criterios locales: {e}")
+        return criterios_locales, False
+    if structured_response is None:
+        # The LLM answered but nothing usable came out of it
+        return criterios_locales or dict(CRITERIOS_POR_DEFECTO), False
+    # The deterministic criteria take precedence over the LLM output
+    structured_response.update(criterios_locales)
+    return structured_response, True
+
+
+def consulta_llm(user_input):
+    """
+    Extracts the search criteria of a query with the LLM.
+
+    Returns:
+        dict | None: Criteria with valid keys only, or None if the answer is not JSON or has none.
+    """
     response = client.chat.completions.create(
         model="gpt-4o-mini",
+        timeout=TIMEOUT_LLM,
         response_format={"type": "json_object"},  # Ensure JSON output
         messages=[
             {
@@ -104,70 +506,344 @@ def chatbot_query(df, user_input):
 
     try:
         structured_response = json.loads(response.choices[0].message.content)  # Parse JSON response
+    except json.JSONDecodeError:
+        return None
 
-        # ✅ Filtrar solo columnas válidas
-        structured_response = {k: v for k, v in structured_response.items() if k in VALID_COLUMNS}
+    # ✅ Filtrar solo columnas válidas
+    structured_response = _filtrar_criterios(structured_response) if isinstance(structured_response, dict) else {}
+    return structured_response or None
 
-        # ✅ Establecer un valor por defecto si no se extrae información
-        if not structured_response:
-            structured_response = {"tipo": "piso"}  # Default fallback
 
-    except json.JSONDecodeError:
-        structured_response = {"tipo": "piso"}  # Fallback case
+# -------------------------------------------------------------------
+# Inverted keyword index: accent-insensitive token -> row positions, built once per dataset
+# -------------------------------------------------------------------
+_PATRON_TOKEN = r"[a-z0-9]+"
+COLUMNAS_TEXTO = ["tipo", "distrito", "direccion", "descripcion"]
+
+
+class IndiceTexto:
+    """
+    Inverted index over the text columns of a DataFrame. For each column, the postings (sorted row
+    positions) of every token are stored contiguously (CSR layout), with the vocabulary sorted so
+    that a keyword also matches the tokens it prefixes ('atico' -> 'aticos').
+    """
 
-    return structured_response
+    def __init__(self, df, columnas=None):
+        self.index = df.index
+        self.n_filas = len(df)
+        self.columnas = {}
+        for columna in columnas or COLUMNAS_TEXTO:
+            if columna in df.columns:
+                self.columnas[columna] = self._indexar(df[columna])
+        self._alineacion = (None, None)
 
+    @staticmethod
+    def _indexar(serie):
+        # Through object dtype: fillna("") is not allowed on categorical columns
+        textos = pd.Series(serie.astype(object).fillna("").astype(str).to_numpy()).map(normalizar_texto)
+        tokens = textos.str.findall(_PATRON_TOKEN).explode().dropna()
+        posiciones = tokens.index.to_numpy(dtype=np.int32)
+        codigos, vocabulario = pd.factorize(tokens.to_numpy())
 
-# Property Search Function (Returns the **Best Single Match**)
-def find_best_match(df, criteria):
-    filtered_df = df.copy()
+        # Sort by (token, position) and drop repeated tokens within a row
+        orden = np.lexsort((posiciones, codigos))
+        codigos, posiciones = codigos[orden], posiciones[orden]
+        unicos = np.ones(len(codigos), dtype=bool)
+        unicos[1:] = (codigos[1:] != codigos[:-1]) | (posiciones[1:] != posiciones[:-1])
+        codigos, posiciones = codigos[unicos], posiciones[unicos]
+        limites = np.searchsorted(codigos, np.arange(len(vocabulario) + 1))
+
+        orden_vocabulario = np.argsort(vocabulario)
+        return {
+            "vocabulario": list(vocabulario[orden_vocabulario]),
+            "inicios": limites[:-1][orden_vocabulario],
+            "finales": limites[1:][orden_vocabulario],
+            "posiciones": posiciones,
+        }
+
+    def _posiciones_token(self, datos, token):
+        # Union of the postings of every token that starts with `token`
+        vocabulario = datos["vocabulario"]
+        desde = bisect_left(vocabulario, token)
+        hasta = bisect_left(vocabulario, token + "\uffff", desde)
+        if hasta - desde == 1:
+            return datos["posiciones"][datos["inicios"][desde]:datos["finales"][desde]]
+        trozos = [datos["posiciones"][i:j] for i, j in zip(datos["inicios"][desde:hasta], datos["finales"][desde:hasta])]
+        return np.unique(np.concatenate(trozos)) if trozos else np.empty(0, dtype=np.int32)
+
+    def buscar(self, valor, columnas):
+        """
+        Rows where any of `columnas` contains every keyword of `valor` (case and accent insensitive).
+
+        Returns:
+            np.ndarray | None: Sorted row positions, or None if `valor` has no keywords (matches all).
+        """
+        tokens = re.findall(_PATRON_TOKEN, normalizar_texto(valor))
+        if not tokens:
+            return None
+        resultado = np.empty(0, dtype=np.int32)
+        for columna in columnas:
+            datos = self.columnas.get(columna)
+            if datos is None:
+                continue
+            posiciones = None
+            for token in tokens:
+                encontradas = self._posiciones_token(datos, token)
+                posiciones = encontradas if posiciones is None else np.intersect1d(posiciones, encontradas, assume_unique=True)
+                if len(posiciones) == 0:
+                    break
+            resultado = np.union1d(resultado, posiciones)
+        return resultado
+
+    def mascara(self, valor, columnas, df):
+        """Boolean mask over the rows of `df` (which may be a reordered view of the indexed frame)."""
+        posiciones = self.buscar(valor, columnas)
+        if posiciones is None:
+            return np.ones(len(df), dtype=bool)
+        mascara = np.zeros(self.n_filas, dtype=bool)
+        mascara[posiciones] = True
+        if df.index is self.index:
+            return mascara
+        alineacion = self._alinear(df.index)
+        return np.where(alineacion >= 0, mascara[alineacion], False)
 
+    def _alinear(self, index):
+        # Position in the indexed frame of each row of `index`; reused while the frame is the same.
+        # The index is shared by sessions and worker threads: the (frame, positions) pair is read
+        # once and replaced as a whole, so a concurrent call can never pair a frame with the
+        # positions of another
+        cacheada_index, cacheada = self._alineacion
+        if cacheada_index is index:
+            return cacheada
+        alineacion = self.index.get_indexer(index)
+        self._alineacion = (index, alineacion)
+        return alineacion
+
+
+def construir_indice_texto(df, columnas=None):
+    """
+    Builds the inverted keyword index used by `find_best_match` for string criteria.
+
+    Args:
+        df (pd.DataFrame): Listings, with unique index labels.
+        columnas (list, optional): Text columns to index. Defaults to COLUMNAS_TEXTO.
+
+    Returns:
+        IndiceTexto: The index.
+    """
+    return IndiceTexto(df, columnas)
+
+
+# -------------------------------------------------------------------
+# Ranking: weighted relevance (partially matched criteria count) and top-k partial selection
+# -------------------------------------------------------------------
+# Criteria not listed weigh 1
+PESOS_CRITERIOS = {"distrito": 3, "tipo": 2, "precio_max": 2, "precio_min": 2}
+
+
+def _mascaras_criterios(df, criteria, indice=None):
+    # Yields (criterion, boolean mask over the rows of df) for every applicable criterion
     for key, value in criteria.items():
-        if key in filtered_df.columns and key not in ["contacto"]:
+        if (key in df.columns or key in VALID_RANGE_KEYS) and key not in ["contacto"]:
             
             if isinstance(value, (int, float)):
                 # ✅ Handle numeric filters properly (now supports more/less than)
                 if key == "tamanio_max":
-                    filtered_df = filtered_df[filtered_df["tamanio"] <= value]  # Less than or equal
+                    yield key, (df["tamanio"] <= value).to_numpy()  # Less than or equal
                 elif key == "tamanio_min":
-                    filtered_df = filtered_df[filtered_df["tamanio"] >= value]  # More than or equal
+                    yield key, (df["tamanio"] >= value).to_numpy()  # More than or equal
                 elif key == "precio_max":
-                    filtered_df = filtered_df[filtered_df["precio"] <= value]
+                    yield key, (df["precio"] <= value).to_numpy()
                 elif key == "precio_min":
-                    filtered_df = filtered_df[filtered_df["precio"] >= value]
+                    yield key, (df["precio"] >= value).to_numpy()
                 elif key == "banios_max":
-                    filtered_df = filtered_df[filtered_df["banios"] <= value]  # Now supports "less than X"
+                    yield key, (df["banios"] <= value).to_numpy()  # Now supports "less than X"
                 elif key == "banios_min":
-                    filtered_df = filtered_df[filtered_df["banios"] >= value]  # Now supports "more than X"
+                    yield key, (df["banios"] >= value).to_numpy()  # Now supports "more than X"
                 elif key == "habitaciones_max":
-                    filtered_df = filtered_df[filtered_df["habitaciones"] <= value]
+                    yield key, (df["habitaciones"] <= value).to_numpy()
                 elif key == "habitaciones_min":
-                    filtered_df = filtered_df[filtered_df["habitaciones"] >= value]
+                    yield key, (df["habitaciones"] >= value).to_numpy()
                 elif key == "planta":
-                    filtered_df = filtered_df[filtered_df["planta"] == value]  # Exact match for floor number
+                    yield key, (df["planta"] == value).to_numpy()  # Exact match for floor number
                 else:
-                    filtered_df = filtered_df[filtered_df[key] == value]  # Exact match for other numbers
+                    yield key, (df[key] == value).to_numpy()  # Exact match for other numbers
 
             elif isinstance(value, bool):
                 # ✅ Handle True/False filters (e.g., aire_acondicionado, terraza)
-                filtered_df = filtered_df[filtered_df[key] == value]
+                yield key, (df[key] == value).to_numpy()
 
             elif isinstance(value, str):
-                # ✅ Search for keywords in BOTH structured fields and `descripcion`
-                filtered_df = filtered_df[
-                    filtered_df[key].astype(str).str.contains(value, case=False, na=False)
-                    | filtered_df["descripcion"].astype(str).str.contains(value, case=False, na=False)
-                ]
-
-    # ✅ If multiple results, prioritize by Rentabilidad Bruta & Precio
-    if not filtered_df.empty:
-        filtered_df = filtered_df.sort_values(by=["Rentabilidad Bruta", "precio"], ascending=[False, True])
-        best_match = filtered_df.iloc[0].to_dict()  # Return as dictionary
-        return best_match
+                # ✅ Search for keywords in BOTH structured fields and `descripcion`, through the inverted index
+                if indice is None:
+                    indice = construir_indice_texto(df)
+                yield key, indice.mascara(value, [key, "descripcion"], df)
+
+
+def filtrar_viviendas(df, criteria, indice=None):
+    """
+    Boolean mask of the rows of `df` that meet every criterion (same rules as `find_best_match`).
+
+    Args:
+        df (pd.DataFrame): Properties.
+        criteria (dict): Criteria as returned by `chatbot_query`.
+        indice (IndiceTexto, optional): Prebuilt keyword index for `df`.
+
+    Returns:
+        np.ndarray: One boolean per row.
+    """
+    mascara = np.ones(len(df), dtype=bool)
+    for _, mascara_criterio in _mascaras_criterios(df, criteria, indice):
+        mascara &= mascara_criterio
+        if not mascara.any():
+            break
+    return mascara
+
+
+def _seleccionar_top_k(relevancia, rentabilidad, precio, k, similitud=None):
+    """
+    Positions of the k best rows by (relevancia desc, similitud desc, rentabilidad desc, precio asc),
+    sorted. The similarity only orders rows within the same relevance level. Only the candidates
+    selected with np.partition are sorted, not the whole set.
+    """
+    n = len(relevancia)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # Relevance, similarity and profitability folded into one key: relevance and similarity levels
+    # (1% steps, so near-equal scores are ordered by what follows) are integers, each relevance
+    # level spaced wider than every similarity level and each of those wider than the whole
+    # profitability range
+    niveles = np.round(relevancia * 100)
+    niveles_similitud = np.zeros(n) if similitud is None else np.round(np.asarray(similitud) * 100)
+    rentabilidad = np.asarray(rentabilidad, dtype=np.float64)
+    if np.isnan(rentabilidad).all():
+        rentabilidad = np.zeros(n)
+    minimo = np.nanmin(rentabilidad)
+    rentabilidad = np.where(np.isnan(rentabilidad), minimo, rentabilidad)
+    clave = (niveles * 101 + niveles_similitud) * (rentabilidad.max() - minimo + 1) + (rentabilidad - minimo)
+
+    if k < n:
+        umbral = np.partition(clave, n - k)[n - k]
+        candidatos = np.flatnonzero(clave >= umbral)  # Ties at the boundary are kept, precio decides
+    else:
+        candidatos = np.arange(n)
+    orden = np.lexsort((
+        precio[candidatos], -rentabilidad[candidatos], -niveles_similitud[candidatos], -niveles[candidatos]
+    ))
+    return candidatos[orden[:k]]
+
+
+def rankear_viviendas(df, criteria, k=10, indice=None, pesos=None, solo_completas=False,
+                      consulta=None, semantica=None):
+    """
+    Returns the k properties that best match the criteria, without sorting the whole dataset.
+
+    Each row gets a relevance score: the weighted share of criteria it meets (see PESOS_CRITERIOS),
+    so properties that meet most of the criteria are still offered. If a semantic index and the
+    query text are given, properties with the same relevance are ordered by the similarity between
+    the query and each description (features like 'luminoso' or 'cerca del tranvía' that are not
+    structured fields); a property that meets more criteria always ranks first. Remaining ties are
+    broken by Rentabilidad Bruta (descending) and precio (ascending).
+
+    Args:
+        df (pd.DataFrame): Properties with profitability metrics.
+        criteria (dict): Criteria as returned by `chatbot_query`.
+        k (int): Maximum number of properties to return.
+        indice (IndiceTexto, optional): Prebuilt keyword index for `df`.
+        pesos (dict, optional): Weight per criterion. Defaults to PESOS_CRITERIOS.
+        solo_completas (bool): Only return properties that meet every criterion.
+        consulta (str, optional): Query text for the semantic similarity.
+        semantica (IndiceSemantico, optional): Precomputed description vectors (see soporte_semantica).
+
+    Returns:
+        pd.DataFrame: Up to k rows, best first, with an extra 'relevancia' column (share of criteria
+        met, 0 to 1) and, if the semantic index is used, 'similitud' (0 to 1).
+    """
+    pesos = PESOS_CRITERIOS if pesos is None else pesos
+    puntuacion = np.zeros(len(df))
+    completas = np.ones(len(df), dtype=bool)
+    peso_total = 0.0
+    for key, mascara in _mascaras_criterios(df, criteria, indice):
+        peso = pesos.get(key, 1)
+        puntuacion += peso * mascara
+        peso_total += peso
+        completas &= mascara
+        if solo_completas and not completas.any():
+            break
+
+    relevancia = puntuacion / peso_total if peso_total else np.ones(len(df))
+    candidatos = np.flatnonzero(completas) if solo_completas else np.arange(len(df))
+
+    similitud = None
+    if semantica is not None and consulta:
+        similitud = semantica.similitudes(consulta, df)
+
+    seleccion = candidatos[_seleccionar_top_k(
+        relevancia[candidatos],
+        df["Rentabilidad Bruta"].to_numpy(dtype=np.float64)[candidatos],
+        df["precio"].to_numpy(dtype=np.float64)[candidatos],
+        k,
+        None if similitud is None else similitud[candidatos]
+    )]
+    resultado = df.iloc[seleccion].assign(relevancia=np.round(relevancia[seleccion], 3))
+    if similitud is not None:
+        resultado["similitud"] = np.round(similitud[seleccion], 3)
+    return resultado
+
+
+# Property Search Function (Returns the **Best Single Match**)
+def find_best_match(df, criteria, indice=None, consulta=None, semantica=None):
+    # Best property meeting every criterion; if several, prioritize by description similarity
+    # (when a semantic index is given), Rentabilidad Bruta & Precio
+    ranking = rankear_viviendas(
+        df, criteria, k=1, indice=indice, solo_completas=True, consulta=consulta, semantica=semantica
+    )
+    if not ranking.empty:
+        return ranking.drop(columns=["relevancia", "similitud"], errors="ignore").iloc[0].to_dict()  # Return as dictionary
 
     return "No se han encontrado viviendas con ese criterio."
 
 
+class BusquedaCancelada(Exception):
+    """Raised inside a Housebot search when a newer query has superseded it."""
+
+
+def ejecutar_busqueda(df, user_input, k=10, indice=None, semantica=None, cancelacion=None, estado=None):
+    """
+    Full Housebot pipeline for one query (interpretation + ranking), meant to run in a worker thread.
+    It never calls Streamlit: progress is reported through `estado` and the caller polls it.
+
+    Args:
+        df (pd.DataFrame): Properties with profitability metrics.
+        user_input (str): User query.
+        k (int): Number of matches to return.
+        indice (IndiceTexto, optional): Prebuilt keyword index for `df`.
+        semantica (IndiceSemantico, optional): Precomputed description vectors.
+        cancelacion (threading.Event, optional): Set by the caller when the query is superseded;
+            checked between stages, so a stale search stops as soon as its current stage ends.
+        estado (dict, optional): Receives the current stage under 'etapa'.
+
+    Returns:
+        pd.DataFrame: Ranking as returned by `rankear_viviendas`.
+
+    Raises:
+        BusquedaCancelada: If `cancelacion` is set.
+    """
+    def etapa(texto):
+        if cancelacion is not None and cancelacion.is_set():
+            raise BusquedaCancelada(user_input)
+        if estado is not None:
+            estado["etapa"] = texto
+
+    etapa("Interpretando tu búsqueda")
+    criterios = chatbot_query(df, user_input)
+    etapa("Buscando las viviendas que mejor se ajustan")
+    ranking = rankear_viviendas(df, criterios, k=k, indice=indice, consulta=user_input, semantica=semantica)
+    etapa("Búsqueda completada")
+    return ranking
+
+
 # Display Property Details
 def display_property_details(property_data):
     st.markdown(f"### 🏡 {property_data['tipo'].capitalize()} en {property_data['direccion']}")
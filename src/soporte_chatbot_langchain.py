@@ -1,17 +1,25 @@
 import os
 import json
+import re
+import threading
+import weakref
+from functools import wraps
 import pandas as pd
 import ast
 import folium
+from collections import OrderedDict
 from dotenv import load_dotenv
 
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent # type: ignore
-
-
+from langchain.agents import AgentExecutor, create_openai_functions_agent
 from langchain.chat_models import ChatOpenAI
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.tools import StructuredTool
 from streamlit_folium import st_folium
 import streamlit as st
 
+import src.soporte_chatbot as sc
+import src.soporte_rentabilidad as sr
+
 
 # Función para renderizar carrusel de imágenes
 def render_image_carousel(imagenes):
@@ -61,14 +69,234 @@ OPENAI = os.getenv("OPENAI")
 if not OPENAI:
     raise ValueError("API Key de OpenAI no encontrada en las variables de entorno.")
 
+# Límites del agente: una llamada para elegir herramienta y otra para responder
+MAX_PASOS_AGENTE = 2
+MAX_RESULTADOS_HERRAMIENTA = 10
+MAX_CACHE_HERRAMIENTAS = 256
+
+# Columnas que se muestran al modelo en los resultados de búsqueda
+COLUMNAS_RESULTADO = [
+    "codigo", "tipo", "distrito", "direccion", "precio", "tamanio", "habitaciones", "banios", "planta",
+    "Rentabilidad Bruta", "Rentabilidad Neta", "Cash-on-Cash Return"
+]
+# Columnas que no aportan al resumen (texto libre, URLs, coordenadas)
+COLUMNAS_EXCLUIDAS_RESUMEN = {
+    "descripcion", "urls_imagenes", "url_cocina", "url_banio", "contacto", "anunciante", "geometry", "lat", "lon"
+}
+OPERACIONES_ESTADISTICA = ("mean", "median", "min", "max", "sum", "count")
+
+PROMPT_AGENTE = (
+    "Eres un asistente inmobiliario que responde preguntas sobre un conjunto de viviendas en venta en Zaragoza. "
+    "No tienes acceso directo a los datos: usa como mucho una herramienta y responde con su resultado. "
+    "Si el resumen ya contiene la respuesta, responde sin usar herramientas. "
+    "Cuando recomiendes una vivienda, incluye siempre su código.\n\n"
+    "Resumen de los datos:\n{resumen}"
+)
+
+
+def version_dataset(df):
+    """
+    Marcador de versión del DataFrame: el de `load_data` si existe o, si no, un hash de su contenido clave.
+    Incluye siempre un hash de las métricas de rentabilidad, que dependen de los datos de financiación
+    y no solo de la versión de las viviendas (y `pd.concat` no conserva `attrs`).
+    """
+    version = df.attrs.get("version")
+    columnas = [col for col in ("codigo", "precio") if col in df.columns] if version is None else []
+    columnas += [col for col in sr.METRICAS if col in df.columns]
+    contenido = str(pd.util.hash_pandas_object(df[columnas] if columnas else df.iloc[:, :0], index=True).sum())
+    return contenido if version is None else f"{version}:{contenido}"
+
+
+def resumir_dataframe(df):
+    """
+    Esquema y estadísticas del DataFrame en pocas líneas, para el prompt del agente
+    (en lugar de dar acceso al DataFrame completo).
+
+    Args:
+        df (pd.DataFrame): Viviendas.
+
+    Returns:
+        str: Resumen en texto.
+    """
+    lineas = [f"{len(df)} viviendas. Columnas:"]
+    for columna in df.columns:
+        if columna in COLUMNAS_EXCLUIDAS_RESUMEN:
+            continue
+        serie = df[columna]
+        if pd.api.types.is_bool_dtype(serie):
+            lineas.append(f"- {columna} (sí/no): {serie.mean():.0%} sí")
+        elif pd.api.types.is_numeric_dtype(serie):
+            lineas.append(
+                f"- {columna} (número): mín {serie.min():,.2f}, mediana {serie.median():,.2f}, máx {serie.max():,.2f}"
+            )
+        else:
+            try:
+                conteos = serie.value_counts()
+            except TypeError:
+                continue  # Valores no hashables (listas)
+            if len(conteos) <= 30:
+                valores = ", ".join(f"{valor} ({n})" for valor, n in conteos.items())
+                lineas.append(f"- {columna} (texto): {valores}")
+            else:
+                lineas.append(f"- {columna} (texto, {len(conteos)} valores distintos)")
+
+    if "distrito" in df.columns and "precio" in df.columns:
+        metricas = [col for col in ("precio", "Rentabilidad Bruta") if col in df.columns]
+        medianas = df.groupby("distrito", observed=True)[metricas].median()
+        lineas.append("Medianas por distrito (" + ", ".join(metricas) + "):")
+        for distrito, fila in medianas.iterrows():
+            lineas.append(f"- {distrito}: " + ", ".join(f"{fila[col]:,.2f}" for col in metricas))
+    return "\n".join(lineas)
+
+
+def _leer_criterios(criterios):
+    try:
+        criterios = json.loads(criterios) if isinstance(criterios, str) and criterios.strip() else (criterios or {})
+    except json.JSONDecodeError:
+        return {}
+    return sc._filtrar_criterios(criterios) if isinstance(criterios, dict) else {}
+
+
+def crear_herramientas(df):
+    """
+    Herramientas del agente sobre el DataFrame, con resultados cacheados por argumentos
+    (una misma pregunta no vuelve a recorrer los datos).
+
+    Args:
+        df (pd.DataFrame): Viviendas con métricas de rentabilidad.
+
+    Returns:
+        list: Herramientas de LangChain.
+    """
+    indice = sc.construir_indice_texto(df)
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    def cacheada(nombre, funcion):
+        @wraps(funcion)  # LangChain deduce los argumentos de la herramienta de la firma
+        def envoltura(**kwargs):
+            clave = (nombre, json.dumps(kwargs, sort_keys=True, default=str))
+            with lock:
+                if clave in cache:
+                    cache.move_to_end(clave)
+                    return cache[clave]
+            resultado = funcion(**kwargs)
+            with lock:
+                cache[clave] = resultado
+                while len(cache) > MAX_CACHE_HERRAMIENTAS:
+                    cache.popitem(last=False)
+            return resultado
+        return envoltura
+
+    def buscar_viviendas(criterios: str = "{}", ordenar_por: str = "Rentabilidad Bruta",
+                         ascendente: bool = False, limite: int = 5) -> str:
+        seleccion = df[sc.filtrar_viviendas(df, _leer_criterios(criterios), indice)]
+        if seleccion.empty:
+            return "No hay viviendas con esos criterios."
+        if ordenar_por not in df.columns or not pd.api.types.is_numeric_dtype(df[ordenar_por]):
+            ordenar_por = "Rentabilidad Bruta"
+        limite = max(1, min(int(limite), MAX_RESULTADOS_HERRAMIENTA))
+        # Selección parcial en lugar de ordenar todo el subconjunto
+        mejores = seleccion.nsmallest(limite, ordenar_por) if ascendente else seleccion.nlargest(limite, ordenar_por)
+        columnas = [col for col in COLUMNAS_RESULTADO if col in df.columns]
+        return f"{len(seleccion)} viviendas cumplen los criterios. Mejores:\n" + mejores[columnas].to_csv(index=False)
+
+    def estadistica(columna: str, operacion: str = "mean", agrupar_por: str = "", criterios: str = "{}") -> str:
+        if columna not in df.columns or operacion not in OPERACIONES_ESTADISTICA:
+            return f"Columna u operación no válida. Operaciones: {', '.join(OPERACIONES_ESTADISTICA)}."
+        # Solo 'count' admite columnas de texto: el resto fallaría dentro del agente
+        if operacion != "count" and not pd.api.types.is_numeric_dtype(df[columna]):
+            numericas = [col for col in COLUMNAS_RESULTADO if col in df.columns and pd.api.types.is_numeric_dtype(df[col])]
+            return f"'{columna}' no es numérica; usa 'count' o una de: {', '.join(numericas)}."
+        seleccion = df[sc.filtrar_viviendas(df, _leer_criterios(criterios), indice)]
+        if agrupar_por in df.columns and agrupar_por not in COLUMNAS_EXCLUIDAS_RESUMEN:
+            return seleccion.groupby(agrupar_por, observed=True)[columna].agg(operacion).round(2).to_string()
+        return str(round(seleccion[columna].agg(operacion), 2))
+
+    descripcion_criterios = (
+        "criterios: JSON con claves de " + ", ".join(sc.VALID_COLUMNS + sc.VALID_RANGE_KEYS)
+        + " (p. ej. {\"distrito\": \"Delicias\", \"precio_max\": 150000})."
+    )
+    return [
+        StructuredTool.from_function(
+            func=cacheada("buscar_viviendas", buscar_viviendas),
+            name="buscar_viviendas",
+            description=(
+                "Busca viviendas que cumplan unos criterios y devuelve las mejores según una columna numérica. "
+                + descripcion_criterios
+            ),
+        ),
+        StructuredTool.from_function(
+            func=cacheada("estadistica", estadistica),
+            name="estadistica",
+            description=(
+                "Calcula una estadística (mean, median, min, max, sum, count) de una columna, opcionalmente "
+                "agrupada por otra columna y sobre las viviendas que cumplan unos criterios. " + descripcion_criterios
+            ),
+        ),
+    ]
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _construir_agente(_df, version):
+    # Un agente por versión de los datos, compartido entre sesiones
+    llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, openai_api_key=OPENAI)
+    herramientas = crear_herramientas(_df)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", PROMPT_AGENTE),
+        ("human", "{input}"),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ]).partial(resumen=resumir_dataframe(_df))
+    agente = create_openai_functions_agent(llm, herramientas, prompt)
+    return AgentExecutor(
+        agent=agente,
+        tools=herramientas,
+        max_iterations=MAX_PASOS_AGENTE,
+        early_stopping_method="force",
+        handle_parsing_errors=True,
+        verbose=False,
+    )
+
+
 # Crear agente de LangChain para el DataFrame
 def langchain_agent(df):
-    llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, openai_api_key=OPENAI)
-    
-    # Enable execution of code inside the agent
-    agent = create_pandas_dataframe_agent(llm, df, verbose=True, allow_dangerous_code=True)
-    
-    return agent
+    """
+    Devuelve el agente para el DataFrame, creado una sola vez por versión de los datos. El agente no
+    ejecuta código arbitrario: ve un resumen precalculado de los datos y dos herramientas acotadas
+    (búsqueda y estadísticas), con un máximo de MAX_PASOS_AGENTE llamadas al modelo por pregunta.
+    """
+    return _construir_agente(df, version_dataset(df))
+
+# Índice codigo -> posición de fila por DataFrame, mientras el DataFrame exista
+_indices_codigos = {}
+_lock_indices = threading.Lock()
+
+
+def _indice_codigos(df):
+    with _lock_indices:
+        entrada = _indices_codigos.get(id(df))
+        if entrada is not None and entrada[0]() is df:
+            return entrada[1]
+        # Los códigos repetidos conservan la primera fila, como la búsqueda anterior
+        codigos = df["codigo"].astype(str).to_numpy()
+        indice = {}
+        for posicion, codigo in enumerate(codigos):
+            indice.setdefault(codigo, posicion)
+        clave = id(df)
+        _indices_codigos[clave] = (weakref.ref(df, lambda _: _indices_codigos.pop(clave, None)), indice)
+        return indice
+
+
+def _posicion_en_respuesta(response, df):
+    # Primer token de la respuesta que sea un código de vivienda: una pasada por la respuesta
+    # y una búsqueda en un diccionario por token, sin recorrer los códigos
+    indice = _indice_codigos(df)
+    for token in re.findall(r"[A-Za-z0-9]+", response):
+        posicion = indice.get(token)
+        if posicion is not None:
+            return token, posicion
+    return None, None
+
 
 def extract_property_id(response, df):
     """
@@ -79,15 +307,13 @@ def extract_property_id(response, df):
     :param df: The DataFrame containing property data
     :return: The matched property ID or None
     """
-    for property_id in df["codigo"].astype(str):  # Ensure IDs are strings for matching
-        if property_id in response:
-            return property_id
-    return None
+    property_id, _ = _posicion_en_respuesta(response, df)
+    return property_id
 
 # Función para consultar el DataFrame
 def consultar_dataframe(agent, consulta_usuario, df):
     try:
-        response = agent.run(consulta_usuario)
+        response = agent.invoke({"input": consulta_usuario})["output"]
 
         # If the response is a DataFrame, return the first row
         if isinstance(response, pd.DataFrame) and not response.empty:
@@ -95,9 +321,9 @@ def consultar_dataframe(agent, consulta_usuario, df):
 
         # If response is a string, try to extract property ID
         elif isinstance(response, str):
-            property_id = extract_property_id(response, df)
+            property_id, posicion = _posicion_en_respuesta(response, df)
             if property_id is not None:
-                return df.loc[df["codigo"] == property_id].iloc[0]
+                return df.iloc[posicion]
 
             return None  # Return None instead of a string to avoid TypeError
 
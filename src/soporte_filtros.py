@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+# Índice de los filtros de las páginas (multiselect de distritos y sliders de rango), construido una
+# vez por versión del dataset. Cada condición se resuelve como un bitset (un bit por fila, empaquetado
+# con np.packbits) y los filtros se combinan con AND, sin volver a recorrer las columnas de la tabla.
+COLUMNAS_RANGO = ["precio", "tamanio"]
+COLUMNAS_CATEGORIA = ["distrito"]
+COLUMNAS_PUNTUACION = ["puntuacion_banio", "puntuacion_cocina"]
+COLUMNAS_COORDENADAS = ["lat", "lon"]
+
+
+class IndiceFiltros:
+    """
+    Filtros precalculados de la tabla de viviendas:
+
+    - Columnas de rango (precio, tamaño): valores ordenados con la posición de su fila, de modo que un
+      rango se resuelve con dos búsquedas binarias.
+    - Columnas de categoría (distrito) y de puntuación (baño, cocina): un bitset por valor. Un rango de
+      puntuaciones es el OR de los bitsets de los valores que contiene.
+    - Un bitset de filas sin nulos por columna, para las condiciones de tipo `dropna`.
+
+    Los resultados coinciden con los de `isin`/`between` (extremos incluidos, nulos excluidos).
+    """
+
+    def __init__(self, df, rangos=None, categorias=None, puntuaciones=None, no_nulos=None):
+        self.n_filas = len(df)
+        self._vacio = np.zeros((self.n_filas + 7) // 8, dtype=np.uint8)
+        self._todas = self._bitset(np.ones(self.n_filas, dtype=bool))
+        self.ordenados = {}
+        self.bitsets = {}
+        self.validas = {}
+        self.limites = {}
+        self.opciones = {}
+        self._extremos = {}
+
+        for columna in rangos or COLUMNAS_RANGO:
+            if columna not in df.columns:
+                continue
+            valores = pd.to_numeric(df[columna], errors="coerce").to_numpy(dtype=np.float64)
+            presentes = ~np.isnan(valores)
+            posiciones = np.flatnonzero(presentes)
+            orden = np.argsort(valores[posiciones], kind="stable")
+            self.ordenados[columna] = (valores[posiciones][orden], posiciones[orden])
+            self.validas[columna] = self._bitset(presentes)
+            if len(posiciones):
+                self._extremos[columna] = (valores[posiciones].min(), valores[posiciones].max())
+                # Límites de los sliders, como los calculaba cada página con int(min()) e int(max())
+                self.limites[columna] = tuple(int(extremo) for extremo in self._extremos[columna])
+
+        for columna in [*(categorias or COLUMNAS_CATEGORIA), *(puntuaciones or COLUMNAS_PUNTUACION)]:
+            if columna not in df.columns:
+                continue
+            codigos, valores = pd.factorize(df[columna], sort=False)
+            self.bitsets[columna] = {
+                valor: self._bitset(codigos == i) for i, valor in enumerate(valores)
+            }
+            self.validas[columna] = self._bitset(codigos >= 0)
+            # Mismo orden que `unique()`: el de aparición en la tabla
+            self.opciones[columna] = list(valores)
+
+        for columna in no_nulos or COLUMNAS_COORDENADAS:
+            if columna in df.columns and columna not in self.validas:
+                self.validas[columna] = self._bitset(df[columna].notna().to_numpy())
+
+    def _bitset(self, mascara):
+        return np.packbits(mascara)
+
+    def _bitset_posiciones(self, posiciones):
+        mascara = np.zeros(self.n_filas, dtype=bool)
+        mascara[posiciones] = True
+        return self._bitset(mascara)
+
+    def _bitset_rango(self, columna, minimo, maximo):
+        if columna in self.ordenados:
+            valores, posiciones = self.ordenados[columna]
+            extremos = self._extremos.get(columna)
+            if extremos and minimo <= extremos[0] and maximo >= extremos[1]:
+                return self.validas[columna]  # El rango cubre todos los valores
+            desde = np.searchsorted(valores, minimo, side="left")
+            hasta = np.searchsorted(valores, maximo, side="right")
+            return self._bitset_posiciones(posiciones[desde:hasta])
+        # Columna de puntuación: unión de los bitsets de los valores dentro del rango
+        return self._union(
+            bitset for valor, bitset in self.bitsets[columna].items() if minimo <= valor <= maximo
+        )
+
+    def _union(self, bitsets):
+        resultado = self._vacio
+        for bitset in bitsets:
+            resultado = resultado | bitset
+        return resultado
+
+    def _bitset_valores(self, columna, valores):
+        bitsets = self.bitsets[columna]
+        valores = set(valores)
+        if valores.issuperset(bitsets):
+            return self.validas[columna]  # Todas las opciones seleccionadas
+        return self._union(bitsets[valor] for valor in valores if valor in bitsets)
+
+    def filtrar(self, filtros, no_nulos=()):
+        """
+        Resuelve una combinación de filtros.
+
+        Args:
+            filtros (dict): Por columna, una tupla (mínimo, máximo) con los extremos incluidos, o una
+                lista de valores admitidos.
+            no_nulos (iterable): Columnas que no pueden ser nulas (como `dropna(subset=...)`).
+
+        Returns:
+            np.ndarray: Máscara booleana sobre las filas de la tabla indexada.
+        """
+        resultado = self._todas
+        for columna, condicion in filtros.items():
+            if isinstance(condicion, tuple):
+                bitset = self._bitset_rango(columna, *condicion)
+            else:
+                bitset = self._bitset_valores(columna, condicion)
+            resultado = resultado & bitset
+        for columna in no_nulos:
+            resultado = resultado & self.validas[columna]
+        return np.unpackbits(resultado, count=self.n_filas).astype(bool)
+
+
+def construir_indice_filtros(df):
+    """
+    Construye el índice de filtros de la tabla de viviendas.
+
+    Args:
+        df (pd.DataFrame): Viviendas.
+
+    Returns:
+        IndiceFiltros: El índice.
+    """
+    return IndiceFiltros(df)
@@ -6,8 +6,14 @@ from pandas import json_normalize
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
+from array import array
+from collections import OrderedDict
+import numpy as np
+import ast
 import os
 import json
+import threading
+import time
 
 
 load_dotenv()
@@ -16,11 +22,111 @@ mongo_uri = os.getenv("mongo_uri")
 if not mongo_uri:
     raise ValueError("mongo_uri no está definido en las variables de entorno")
 
+# Carpeta local donde se guardan las copias (snapshots) de las colecciones
+directorio_snapshots = os.getenv("snapshot_dir", "snapshots")
+# Campo de fecha de modificación de los documentos (si la colección lo tiene): con él, el marcador de
+# versión y la sincronización incremental detectan también las modificaciones
+CAMPO_ACTUALIZACION = os.getenv("mongo_updated_field", "properties.updated_at")
+# Edad máxima (segundos) de una copia local: pasado ese tiempo se vuelve a importar aunque el marcador
+# coincida, para recoger las modificaciones que el marcador no detecta
+MAX_EDAD_SNAPSHOT = int(os.getenv("snapshot_max_age", str(24 * 3600)))
+
+# Pool de conexiones y tiempos de espera del cliente compartido
+MAX_CONEXIONES = int(os.getenv("mongo_max_pool_size", "20"))
+TIMEOUT_SELECCION_MS = int(os.getenv("mongo_server_selection_timeout_ms", "5000"))
+TIMEOUT_CONEXION_MS = int(os.getenv("mongo_connect_timeout_ms", "5000"))
+TIMEOUT_SOCKET_MS = int(os.getenv("mongo_socket_timeout_ms", "30000"))
+# Comprobación de salud en segundo plano: un ping cada INTERVALO_SALUD segundos y un aviso tras
+# FALLOS_PARA_AVISAR pings fallidos seguidos. El cliente no se sustituye: pymongo recupera solo sus
+# conexiones cuando el servidor vuelve, y `bd`/colecciones que ya tengan otros siguen siendo válidos
+INTERVALO_SALUD = 30
+FALLOS_PARA_AVISAR = 3
+
+# Un cliente por URI para todo el proceso (todas las sesiones y reruns de Streamlit)
+_clientes = {}
+_fallos_clientes = {}
+_lock_clientes = threading.Lock()
+_hilo_salud = None
+
+
+def _crear_cliente(uri):
+    return MongoClient(
+        uri,
+        server_api=ServerApi('1'),
+        maxPoolSize=MAX_CONEXIONES,
+        serverSelectionTimeoutMS=TIMEOUT_SELECCION_MS,
+        connectTimeoutMS=TIMEOUT_CONEXION_MS,
+        socketTimeoutMS=TIMEOUT_SOCKET_MS,
+        retryReads=True,
+        retryWrites=True
+    )
+
+
+def get_cliente(uri=None):
+    """
+    Devuelve el cliente de MongoDB compartido por el proceso para una URI, creándolo la primera vez.
+    El cliente mantiene un pool de como máximo MAX_CONEXIONES conexiones, así que muchas sesiones
+    simultáneas no abren una conexión nueva cada una.
+
+    Args:
+        uri (str, optional): URI de conexión. Por defecto, la de la variable de entorno `mongo_uri`.
+
+    Returns:
+        pymongo.MongoClient: Cliente compartido.
+    """
+    global _hilo_salud
+    uri = uri or mongo_uri
+    with _lock_clientes:
+        cliente = _clientes.get(uri)
+        if cliente is None:
+            cliente = _clientes[uri] = _crear_cliente(uri)
+            _fallos_clientes[uri] = 0
+        if _hilo_salud is None:
+            _hilo_salud = threading.Thread(target=_vigilar_clientes, name="mongo-salud", daemon=True)
+            _hilo_salud.start()
+    return cliente
+
+
+def comprobar_conexion(cliente):
+    """
+    Comprueba si el servidor responde a un ping.
+
+    Args:
+        cliente (pymongo.MongoClient): Cliente a comprobar.
+
+    Returns:
+        bool: True si el servidor ha respondido.
+    """
+    try:
+        cliente.admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+
+def _vigilar_clientes():
+    while True:
+        time.sleep(INTERVALO_SALUD)
+        with _lock_clientes:
+            clientes = list(_clientes.items())
+        for uri, cliente in clientes:
+            disponible = comprobar_conexion(cliente)
+            with _lock_clientes:
+                anteriores = _fallos_clientes.get(uri, 0)
+                _fallos_clientes[uri] = 0 if disponible else anteriores + 1
+                fallos = _fallos_clientes[uri]
+            if fallos == FALLOS_PARA_AVISAR:
+                print(f"MongoDB no responde tras {fallos} comprobaciones; el cliente reintentará la conexión")
+            elif disponible and anteriores >= FALLOS_PARA_AVISAR:
+                print("MongoDB vuelve a responder")
+
 
 # Conectar a MongoDB Atlas
 def conectar_a_mongo(nombre_bd: str):
     """
-    Conecta a una base de datos en MongoDB Atlas y devuelve el objeto de la base de datos.
+    Conecta a una base de datos en MongoDB Atlas y devuelve el objeto de la base de datos. Usa el
+    cliente compartido del proceso (ver `get_cliente`), así que llamarla en cada rerun no abre
+    conexiones nuevas.
 
     Args:
         nombre_bd (str): Nombre de la base de datos a la que se desea conectar.
@@ -28,12 +134,11 @@ def conectar_a_mongo(nombre_bd: str):
     Returns:
         pymongo.database.Database: Objeto de la base de datos MongoDB.
     """
-    cliente = MongoClient(mongo_uri, server_api=ServerApi('1'))
-    return cliente[nombre_bd]
+    return get_cliente()[nombre_bd]
 
 
 # Función para importar una colección de MongoDB a un DataFrame
-def importar_a_dataframe(bd, nombre_coleccion):
+def importar_a_dataframe(bd, nombre_coleccion, filtro=None, proyeccion=None):
     """
     Importa una colección de MongoDB a un DataFrame de pandas, manteniendo los nombres originales de las columnas 
     y eliminando las columnas '_id', 'type', y 'id'.
@@ -41,12 +146,14 @@ def importar_a_dataframe(bd, nombre_coleccion):
     Args:
         bd (pymongo.database.Database): Objeto de la base de datos MongoDB.
         nombre_coleccion (str): Nombre de la colección en MongoDB que se desea importar.
+        filtro (dict, optional): Consulta que se aplica en el servidor.
+        proyeccion (dict, optional): Campos a devolver (proyección de `find()`).
 
     Returns:
         pd.DataFrame: DataFrame con los datos de la colección, con las columnas específicas eliminadas.
     """
     coleccion = bd[nombre_coleccion]
-    documentos = list(coleccion.find())
+    documentos = list(coleccion.find(filtro or {}, proyeccion))
 
     if documentos:
         # Convertir documentos a DataFrame
@@ -62,7 +169,7 @@ def importar_a_dataframe(bd, nombre_coleccion):
         return pd.DataFrame()
 
 
-def importar_a_geodataframe(bd, nombre_coleccion):
+def importar_a_geodataframe(bd, nombre_coleccion, filtro=None, proyeccion=None):
     """
     Importa una colección de MongoDB a un GeoDataFrame de geopandas, procesando correctamente la columna 'geometry',
     eliminando columnas innecesarias y ajustando los nombres de las columnas.
@@ -70,12 +177,14 @@ def importar_a_geodataframe(bd, nombre_coleccion):
     Args:
         bd (pymongo.database.Database): Objeto de la base de datos MongoDB.
         nombre_coleccion (str): Nombre de la colección en MongoDB que se desea importar.
+        filtro (dict, optional): Consulta que se aplica en el servidor.
+        proyeccion (dict, optional): Campos a devolver (proyección de `find()`).
 
     Returns:
         gpd.GeoDataFrame: GeoDataFrame con los datos de la colección.
     """
     coleccion = bd[nombre_coleccion]
-    documentos = list(coleccion.find())
+    documentos = list(coleccion.find(filtro or {}, proyeccion))
 
     if documentos:
         # Convertir documentos a DataFrame, preservando columnas anidadas
@@ -97,4 +206,583 @@ def importar_a_geodataframe(bd, nombre_coleccion):
         return gpd.GeoDataFrame(df, geometry="geometry")
     else:
         print(f"La colección '{nombre_coleccion}' está vacía o no existe.")
-        return gpd.GeoDataFrame()
\ No newline at end of file
+        return gpd.GeoDataFrame()
+
+
+def _aplanar_documento(documento, prefijo=""):
+    """
+    Aplana un documento anidado uniendo las claves con '_', igual que `json_normalize(sep="_")`.
+    Las listas se mantienen como valores.
+    """
+    plano = {}
+    for clave, valor in documento.items():
+        nombre = f"{prefijo}{clave}"
+        if isinstance(valor, dict):
+            plano.update(_aplanar_documento(valor, f"{nombre}_"))
+        else:
+            plano[nombre] = valor
+    return plano
+
+
+def importar_en_lotes(bd, nombre_coleccion, filtro=None, proyeccion=None, geometria=True, tamanio_lote=1000):
+    """
+    Importa una colección de MongoDB leyendo el cursor por lotes directamente a buffers por columna,
+    sin crear la lista intermedia de documentos ni pasar por `json_normalize`. Las coordenadas de
+    'geometry.coordinates' se leen directamente a arrays float64 de longitud y latitud.
+
+    Con `geometria=True` el resultado equivale al de `importar_a_geodataframe`, con las columnas
+    'lat' y 'lon' añadidas; con `geometria=False`, al de `importar_a_dataframe`.
+
+    Args:
+        bd (pymongo.database.Database): Objeto de la base de datos MongoDB.
+        nombre_coleccion (str): Nombre de la colección en MongoDB que se desea importar.
+        filtro (dict, optional): Consulta que se aplica en el servidor.
+        proyeccion (dict, optional): Campos a devolver (proyección de `find()`).
+        geometria (bool): Si se construye un GeoDataFrame a partir de 'geometry.coordinates'.
+        tamanio_lote (int): Número de documentos por lote del cursor.
+
+    Returns:
+        gpd.GeoDataFrame | pd.DataFrame: Datos de la colección.
+    """
+    cursor = bd[nombre_coleccion].find(filtro or {}, proyeccion).batch_size(tamanio_lote)
+    return tabla_desde_documentos(cursor, geometria, nombre_coleccion)
+
+
+def tabla_desde_documentos(documentos, geometria=True, nombre_coleccion=""):
+    """
+    Construye la tabla de `importar_en_lotes` a partir de cualquier iterable de documentos (un cursor
+    de pymongo o los lotes que va leyendo `soporte_mongo_async`).
+
+    Args:
+        documentos (iterable): Documentos de la colección.
+        geometria (bool): Si se construye un GeoDataFrame a partir de 'geometry.coordinates'.
+        nombre_coleccion (str): Nombre de la colección, para los mensajes.
+
+    Returns:
+        gpd.GeoDataFrame | pd.DataFrame: Datos de la colección.
+    """
+    if geometria:
+        columnas_a_eliminar = {"_id", "type", "id", "geometry_type", "geometry_coordinates"}
+    else:
+        columnas_a_eliminar = {"_id", "type", "id"}
+
+    columnas = {}
+    lon, lat = array("d"), array("d")
+    n_documentos = 0
+
+    for documento in documentos:
+        fila = _aplanar_documento(documento)
+
+        if geometria:
+            coords = fila.get("geometry_coordinates")
+            if isinstance(coords, list) and len(coords) >= 2:
+                lon.append(float(coords[0]))
+                lat.append(float(coords[1]))
+            else:
+                lon.append(np.nan)
+                lat.append(np.nan)
+
+        for clave, valor in fila.items():
+            if clave in columnas_a_eliminar:
+                continue
+            if geometria:
+                clave = clave.replace("properties_", "")
+            columna = columnas.get(clave)
+            if columna is None:
+                # Columna nueva: rellenar los documentos anteriores que no la tenían
+                columna = columnas[clave] = [np.nan] * n_documentos
+            columna.append(valor)
+
+        n_documentos += 1
+        for columna in columnas.values():
+            if len(columna) < n_documentos:
+                columna.append(np.nan)
+
+    if not n_documentos:
+        print(f"La colección '{nombre_coleccion}' está vacía o no existe.")
+        return gpd.GeoDataFrame() if geometria else pd.DataFrame()
+
+    df = pd.DataFrame(columnas)
+    if not geometria:
+        return df
+
+    lon = np.frombuffer(lon, dtype=np.float64)
+    lat = np.frombuffer(lat, dtype=np.float64)
+    puntos = gpd.points_from_xy(lon, lat)
+    puntos[np.isnan(lon) | np.isnan(lat)] = None
+    df["geometry"] = puntos
+    df["lat"] = lat
+    df["lon"] = lon
+
+    return gpd.GeoDataFrame(df, geometry="geometry")
+
+
+
+def obtener_marcador_version(bd, nombre_coleccion):
+    """
+    Obtiene un marcador barato de la versión de una colección: el número de documentos, el '_id'
+    más reciente y la fecha de modificación más reciente (CAMPO_ACTUALIZACION). Cambia cuando se
+    insertan o eliminan documentos y, si la colección tiene ese campo, también cuando se modifican.
+    Sin él, las modificaciones solo se recogen cuando caduca la copia local (MAX_EDAD_SNAPSHOT).
+
+    Args:
+        bd (pymongo.database.Database): Objeto de la base de datos MongoDB.
+        nombre_coleccion (str): Nombre de la colección.
+
+    Returns:
+        str: Marcador de versión de la colección.
+    """
+    coleccion = bd[nombre_coleccion]
+    ultimo = coleccion.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    actualizado = coleccion.find_one(
+        {CAMPO_ACTUALIZACION: {"$exists": True}}, {"_id": 0, CAMPO_ACTUALIZACION: 1},
+        sort=[(CAMPO_ACTUALIZACION, -1)]
+    )
+    return formatear_marcador_version(coleccion.count_documents({}), ultimo, actualizado)
+
+
+def formatear_marcador_version(n_documentos, ultimo, actualizado=None):
+    # Compartido con soporte_mongo_async, para que ambas rutas usen las mismas copias locales
+    return f"{n_documentos}:{ultimo['_id'] if ultimo else ''}:{_valor_campo(actualizado, CAMPO_ACTUALIZACION)}"
+
+
+def _valor_campo(documento, campo):
+    # Valor de un campo con notación de puntos ('properties.updated_at'), o '' si no existe
+    for parte in campo.split("."):
+        documento = documento.get(parte) if isinstance(documento, dict) else None
+    return "" if documento is None else documento
+
+
+def version_snapshot(marcador, importador, kwargs):
+    """
+    Versión con la que se guarda una copia local: la copia solo es válida para el mismo marcador de
+    la colección, el mismo importador y los mismos argumentos.
+    """
+    return f"{marcador}|{importador.__name__}|{json.dumps(kwargs, sort_keys=True, default=str)}"
+
+
+def _rutas_snapshot(nombre_coleccion):
+    base = os.path.join(directorio_snapshots, nombre_coleccion)
+    return f"{base}.parquet", f"{base}.pkl", f"{base}.version.json"
+
+
+def leer_snapshot(nombre_coleccion):
+    """
+    Lee la copia local de una colección. Una copia más antigua que MAX_EDAD_SNAPSHOT se devuelve sin
+    versión: no se da por válida, pero se puede usar si MongoDB no está disponible.
+
+    Args:
+        nombre_coleccion (str): Nombre de la colección.
+
+    Returns:
+        tuple: (DataFrame o GeoDataFrame, marcador de versión), o (None, None) si no hay copia.
+    """
+    ruta_parquet, ruta_pickle, ruta_version = _rutas_snapshot(nombre_coleccion)
+    if not os.path.exists(ruta_version):
+        return None, None
+    try:
+        with open(ruta_version, encoding="utf-8") as f:
+            metadatos = json.load(f)
+        if metadatos["formato"] == "parquet":
+            lector = gpd.read_parquet if metadatos["geo"] else pd.read_parquet
+            df = lector(ruta_parquet)
+        else:
+            df = pd.read_pickle(ruta_pickle)
+        if time.time() - metadatos.get("creado", 0) > MAX_EDAD_SNAPSHOT:
+            return df, None
+        return df, metadatos["version"]
+    except Exception as e:
+        print(f"No se pudo leer la copia local de '{nombre_coleccion}': {e}")
+        return None, None
+
+
+def guardar_snapshot(df, nombre_coleccion, version):
+    """
+    Guarda una copia local de una colección en formato Parquet (columnar). Si alguna columna no se
+    puede convertir (por ejemplo, tipos mezclados), se guarda con pickle.
+
+    Args:
+        df (pd.DataFrame | gpd.GeoDataFrame): Datos a guardar.
+        nombre_coleccion (str): Nombre de la colección.
+        version (str): Marcador de versión de la colección (ver `obtener_marcador_version`).
+    """
+    ruta_parquet, ruta_pickle, ruta_version = _rutas_snapshot(nombre_coleccion)
+    os.makedirs(directorio_snapshots, exist_ok=True)
+    try:
+        df.to_parquet(ruta_parquet)
+        formato = "parquet"
+    except Exception as e:
+        print(f"No se pudo guardar '{nombre_coleccion}' en Parquet, se usa pickle: {e}")
+        df.to_pickle(ruta_pickle)
+        formato = "pickle"
+
+    # El marcador se escribe al final: una copia a medio escribir nunca se considera válida
+    ruta_temporal = f"{ruta_version}.tmp"
+    with open(ruta_temporal, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": version, "formato": formato, "geo": isinstance(df, gpd.GeoDataFrame), "creado": time.time()
+        }, f)
+    os.replace(ruta_temporal, ruta_version)
+
+
+def importar_con_snapshot(bd, nombre_coleccion, importador=None, **kwargs):
+    """
+    Carga una colección desde la copia local si su marcador de versión coincide con el de MongoDB, y
+    solo la vuelve a importar (y actualiza la copia) cuando la colección ha cambiado. Si MongoDB no
+    está disponible, se usa la copia local existente.
+
+    Args:
+        bd (pymongo.database.Database): Objeto de la base de datos MongoDB.
+        nombre_coleccion (str): Nombre de la colección.
+        importador (callable, optional): Función `importador(bd, nombre_coleccion, **kwargs)` que
+            importa la colección. Por defecto, `importar_en_lotes`.
+        **kwargs: Argumentos adicionales para el importador.
+
+    Returns:
+        pd.DataFrame | gpd.GeoDataFrame: Datos de la colección.
+    """
+    importador = importador or importar_en_lotes
+    df, version_local = leer_snapshot(nombre_coleccion)
+
+    try:
+        version = version_snapshot(obtener_marcador_version(bd, nombre_coleccion), importador, kwargs)
+    except Exception as e:
+        if df is not None:
+            print(f"MongoDB no disponible, se usa la copia local de '{nombre_coleccion}': {e}")
+            return df
+        raise
+
+    if df is not None and version_local == version:
+        return df
+
+    df = importador(bd, nombre_coleccion, **kwargs)
+    if not df.empty:
+        guardar_snapshot(df, nombre_coleccion, version)
+    return df
+
+
+
+def obtener_marca_agua(bd, nombre_coleccion, campo_marca="_id"):
+    """
+    Obtiene el valor más alto del campo usado como marca de agua para la sincronización incremental.
+
+    Args:
+        bd (pymongo.database.Database): Objeto de la base de datos MongoDB.
+        nombre_coleccion (str): Nombre de la colección.
+        campo_marca (str): Campo creciente ('_id' para detectar inserciones, o un campo de fecha de
+            actualización como 'properties.updated_at' para detectar también modificaciones).
+
+    Returns:
+        Valor máximo del campo, o None si la colección está vacía.
+    """
+    documento = bd[nombre_coleccion].find_one(
+        {campo_marca: {"$exists": True}}, {campo_marca: 1}, sort=[(campo_marca, -1)]
+    )
+    for parte in campo_marca.split("."):
+        documento = documento.get(parte) if isinstance(documento, dict) else None
+    return documento
+
+
+def elegir_campo_marca(bd, nombre_coleccion):
+    """
+    Campo con el que sincronizar una colección: CAMPO_ACTUALIZACION si sus documentos lo tienen (se
+    detectan inserciones y modificaciones) y, si no, '_id' (solo inserciones).
+
+    Args:
+        bd (pymongo.database.Database): Objeto de la base de datos MongoDB.
+        nombre_coleccion (str): Nombre de la colección.
+
+    Returns:
+        str: Campo de la marca de agua.
+    """
+    if bd[nombre_coleccion].find_one({CAMPO_ACTUALIZACION: {"$exists": True}}, {"_id": 1}):
+        return CAMPO_ACTUALIZACION
+    return "_id"
+
+
+def sincronizar_incremental(bd, nombre_coleccion, df, marca_agua, campo_marca="_id", clave="codigo",
+                            prefijo="properties.", **kwargs):
+    """
+    Actualiza un GeoDataFrame ya importado trayendo solo los documentos insertados o modificados desde la
+    última marca de agua, y eliminando los que ya no existen en la colección.
+
+    Las eliminaciones se detectan comparando las claves locales con `distinct()` de la clave en MongoDB,
+    que solo transfiere los códigos. Con `campo_marca="_id"` solo se detectan inserciones; para detectar
+    modificaciones, la colección debe tener un campo de fecha de actualización.
+
+    Args:
+        bd (pymongo.database.Database): Objeto de la base de datos MongoDB.
+        nombre_coleccion (str): Nombre de la colección.
+        df (gpd.GeoDataFrame): Datos importados previamente con `importar_en_lotes`.
+        marca_agua: Marca de agua de la última sincronización (ver `obtener_marca_agua`). Si es None,
+            se vuelven a traer todos los documentos.
+        campo_marca (str): Campo usado como marca de agua.
+        clave (str): Columna que identifica cada vivienda.
+        prefijo (str): Prefijo de los campos en los documentos ('properties.' en las colecciones GeoJSON).
+        **kwargs: Argumentos adicionales para `importar_en_lotes` (por ejemplo, la proyección).
+
+    Returns:
+        tuple: (GeoDataFrame actualizado, diccionario con los códigos 'insertados', 'actualizados' y
+        'eliminados', nueva marca de agua).
+    """
+    coleccion = bd[nombre_coleccion]
+
+    # La marca se lee antes de la consulta: un documento insertado entre ambas se traería dos veces
+    # (sin efecto), pero nunca se perdería
+    nueva_marca = obtener_marca_agua(bd, nombre_coleccion, campo_marca)
+    filtro = {campo_marca: {"$gt": marca_agua}} if marca_agua is not None else {}
+
+    if coleccion.count_documents(filtro, limit=1):
+        cambiados = importar_en_lotes(bd, nombre_coleccion, filtro=filtro, **kwargs)
+    else:
+        cambiados = gpd.GeoDataFrame()
+
+    codigos_locales = set(df[clave]) if clave in df.columns else set()
+    codigos_cambiados = set(cambiados[clave]) if clave in cambiados.columns else set()
+    codigos_eliminados = codigos_locales - set(coleccion.distinct(f"{prefijo}{clave}"))
+
+    cambios = {
+        "insertados": sorted(codigos_cambiados - codigos_locales),
+        "actualizados": sorted(codigos_cambiados & codigos_locales),
+        "eliminados": sorted(codigos_eliminados),
+    }
+    if not codigos_cambiados and not codigos_eliminados:
+        return df, cambios, nueva_marca
+
+    conservados = df[~df[clave].isin(codigos_cambiados | codigos_eliminados)] if clave in df.columns else df
+    if not cambiados.empty:
+        # Índices nuevos y únicos para las filas traídas
+        inicio = int(df.index.max()) + 1 if len(df) else 0
+        cambiados.index = pd.RangeIndex(inicio, inicio + len(cambiados))
+
+    df_actualizado = pd.concat([conservados, cambiados])
+    if isinstance(df, gpd.GeoDataFrame):
+        df_actualizado = gpd.GeoDataFrame(df_actualizado, geometry="geometry", crs=df.crs)
+
+    return df_actualizado, cambios, nueva_marca
+
+
+# Tipos compactos para la tabla de viviendas: texto repetido como categorías, indicadores como
+# bool y puntuaciones y conteos pequeños como int8. Los importes (precio, alquiler) se mantienen
+# en float64 para no cambiar los cálculos de rentabilidad
+ESQUEMA_VIVIENDAS = {
+    "categoria": ["distrito", "tipo", "anunciante", "estado"],
+    "booleano": ["exterior", "ascensor", "aire_acondicionado", "trastero", "terraza", "patio", "parking"],
+    "entero_pequenio": ["habitaciones", "banios", "puntuacion_banio", "puntuacion_cocina"],
+    "float32": ["lat", "lon"],
+}
+
+
+def compactar_tipos(df, esquema=None):
+    """
+    Convierte las columnas de la tabla de viviendas a tipos compactos según un esquema. Las
+    conversiones de booleanos (sin nulos, a bool), enteros pequeños (sin nulos a int8; con nulos, a
+    float32 si los valores se conservan exactos) y texto repetido (a categorías) no pierden
+    información. Las columnas "float32" (lat y lon) sí se redondean: float32 guarda unos 7 dígitos
+    significativos, menos de medio metro en las coordenadas de Zaragoza, y la geometría conserva las
+    coordenadas originales en float64. Se puede aplicar varias veces (por ejemplo, tras
+    `sincronizar_incremental`).
+
+    Args:
+        df (pd.DataFrame | gpd.GeoDataFrame): Viviendas importadas.
+        esquema (dict, optional): Columnas por tipo de destino. Por defecto, ESQUEMA_VIVIENDAS.
+
+    Returns:
+        pd.DataFrame | gpd.GeoDataFrame: Las mismas viviendas con tipos compactos. Las columnas no
+        convertidas se comparten con `df`, sin copiarlas.
+    """
+    esquema = esquema or ESQUEMA_VIVIENDAS
+    convertidas = {}
+
+    for columna in esquema.get("categoria", []):
+        if columna in df.columns and not isinstance(df[columna].dtype, pd.CategoricalDtype):
+            serie = df[columna]
+            # Solo texto (o nulos): una columna con listas u otros objetos no se convierte
+            if serie.map(lambda x: isinstance(x, str) or x is None or x != x).all():
+                convertidas[columna] = serie.astype("category")
+
+    for columna in esquema.get("booleano", []):
+        if columna in df.columns and df[columna].dtype != bool:
+            serie = df[columna]
+            if serie.notna().all() and serie.isin([True, False]).all():
+                convertidas[columna] = serie.astype(bool)
+
+    for columna in esquema.get("entero_pequenio", []):
+        if columna in df.columns and df[columna].dtype not in (np.int8, np.float32):
+            serie = pd.to_numeric(df[columna], errors="coerce")
+            if serie.isna().sum() > df[columna].isna().sum():
+                continue  # Valores no numéricos: se deja como está
+            enteros = serie.dropna()
+            if serie.notna().all() and (enteros == enteros.round()).all() and enteros.between(-128, 127).all():
+                convertidas[columna] = serie.astype(np.int8)
+            elif (enteros.astype(np.float32) == enteros).all():
+                convertidas[columna] = serie.astype(np.float32)
+
+    for columna in esquema.get("float32", []):
+        if columna in df.columns and df[columna].dtype != np.float32 and pd.api.types.is_float_dtype(df[columna]):
+            convertidas[columna] = df[columna].astype(np.float32)
+
+    if not convertidas:
+        return df
+    # Copia superficial: solo se sustituyen las columnas convertidas
+    compacto = df.copy(deep=False)
+    for columna, serie in convertidas.items():
+        compacto[columna] = serie
+    return compacto
+
+
+# Campos pesados de las viviendas (texto e imágenes): no forman parte de la tabla principal, se
+# leen bajo demanda con `AlmacenDetalles`
+CAMPOS_DETALLE = ["descripcion", "urls_imagenes", "url_cocina", "url_banio"]
+
+
+def proyeccion_sin_detalles(proyeccion=None, campos=None, prefijo="properties."):
+    """
+    Añade a una proyección de exclusión los campos pesados, para que no se transfieran al importar.
+
+    Args:
+        proyeccion (dict, optional): Proyección de exclusión de partida (por ejemplo {"_id": 0}).
+        campos (list, optional): Campos a excluir. Por defecto, CAMPOS_DETALLE.
+        prefijo (str): Prefijo de los campos en los documentos ('properties.' en las colecciones GeoJSON).
+
+    Returns:
+        dict: Proyección para `find()`.
+    """
+    proyeccion = dict(proyeccion or {})
+    proyeccion.update({f"{prefijo}{campo}": 0 for campo in campos or CAMPOS_DETALLE})
+    return proyeccion
+
+
+def _parsear_detalle(campo, valor):
+    # Las URLs de imágenes se guardan como el texto de una lista de Python
+    if campo == "urls_imagenes":
+        if isinstance(valor, str):
+            try:
+                valor = ast.literal_eval(valor)
+            except (ValueError, SyntaxError):
+                return []
+        return list(valor) if isinstance(valor, (list, tuple)) else []
+    if campo == "descripcion":
+        return valor if isinstance(valor, str) else ""
+    return None if valor is None or valor != valor else valor
+
+
+def _valor_bson(valor):
+    # pymongo no codifica los escalares de numpy
+    return valor.item() if isinstance(valor, np.generic) else valor
+
+
+class AlmacenDetalles:
+    """
+    Campos pesados de las viviendas (descripción y URLs de imágenes) indexados por código. Se leen
+    de MongoDB solo para las viviendas que se muestran, en lotes con `$in`, y se guardan ya
+    parseados en una caché LRU compartida entre sesiones.
+    """
+
+    def __init__(self, bd, nombre_coleccion, campos=None, clave="codigo", prefijo="properties.",
+                 max_entradas=2000, tamanio_lote=500):
+        self.bd = bd
+        self.nombre_coleccion = nombre_coleccion
+        self.campos = list(campos or CAMPOS_DETALLE)
+        self.clave = clave
+        self.prefijo = prefijo
+        self.max_entradas = max_entradas
+        self.tamanio_lote = tamanio_lote
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _vacio(self):
+        return {campo: _parsear_detalle(campo, None) for campo in self.campos}
+
+    def _leer(self, codigos, campos):
+        # Documentos aplanados por código, con los campos indicados
+        coleccion = self.bd[self.nombre_coleccion]
+        proyeccion = {f"{self.prefijo}{campo}": 1 for campo in [self.clave, *campos]}
+        proyeccion["_id"] = 0
+        filtro = {} if codigos is None else {f"{self.prefijo}{self.clave}": {"$in": [_valor_bson(c) for c in codigos]}}
+        prefijo_plano = self.prefijo.replace(".", "_")
+        for documento in coleccion.find(filtro, proyeccion).batch_size(self.tamanio_lote):
+            fila = {
+                clave[len(prefijo_plano):] if clave.startswith(prefijo_plano) else clave: valor
+                for clave, valor in _aplanar_documento(documento).items()
+            }
+            if self.clave in fila:
+                yield fila[self.clave], fila
+
+    def obtener(self, codigos):
+        """
+        Detalles de varias viviendas. Los que no están en caché se leen en lotes; si MongoDB no
+        responde, esas viviendas se devuelven con los campos vacíos (y no se guardan en caché).
+
+        Args:
+            codigos (iterable): Códigos de las viviendas.
+
+        Returns:
+            dict: Por código, un diccionario con los campos pesados parseados.
+        """
+        codigos = list(dict.fromkeys(_valor_bson(c) for c in codigos))
+        detalles = {}
+        with self._lock:
+            for codigo in codigos:
+                if codigo in self._cache:
+                    self._cache.move_to_end(codigo)
+                    detalles[codigo] = self._cache[codigo]
+        pendientes = [codigo for codigo in codigos if codigo not in detalles]
+
+        for inicio in range(0, len(pendientes), self.tamanio_lote):
+            lote = pendientes[inicio:inicio + self.tamanio_lote]
+            try:
+                leidos = {
+                    codigo: {campo: _parsear_detalle(campo, fila.get(campo)) for campo in self.campos}
+                    for codigo, fila in self._leer(lote, self.campos)
+                }
+            except Exception as e:
+                print(f"No se pudieron leer los detalles de {len(lote)} viviendas: {e}")
+                continue
+            with self._lock:
+                for codigo in lote:
+                    # Un código que ya no existe se guarda vacío para no volver a consultarlo
+                    detalles[codigo] = self._cache[codigo] = leidos.get(codigo) or self._vacio()
+                    self._cache.move_to_end(codigo)
+                while len(self._cache) > self.max_entradas:
+                    self._cache.popitem(last=False)
+
+        return {codigo: detalles.get(codigo) or self._vacio() for codigo in codigos}
+
+    def completar(self, df):
+        """
+        Añade los campos pesados a unas pocas filas (las que se van a mostrar o exportar).
+
+        Args:
+            df (pd.DataFrame): Filas de la tabla principal, con la columna de la clave.
+
+        Returns:
+            pd.DataFrame: Copia superficial de `df` con los campos pesados.
+        """
+        detalles = self.obtener(df[self.clave])
+        completo = df.copy(deep=False)
+        for campo in self.campos:
+            completo[campo] = [detalles[_valor_bson(codigo)][campo] for codigo in df[self.clave]]
+        return completo
+
+    def leer_columna(self, campo):
+        """
+        Lee un campo de todas las viviendas sin pasar por la caché (para construir índices).
+
+        Returns:
+            pd.Series: Valores parseados del campo, indexados por código.
+
+        Raises:
+            pymongo.errors.PyMongoError: Si MongoDB no responde. No se devuelve una columna vacía
+                para que quien la guarde en caché no se quede con índices sin texto.
+        """
+        filas = {codigo: _parsear_detalle(campo, fila.get(campo)) for codigo, fila in self._leer(None, [campo])}
+        return pd.Series(filas, dtype=object)
+
+    def invalidar(self, codigos=None):
+        """Descarta de la caché las viviendas indicadas (todas si es None), por ejemplo tras sincronizar."""
+        with self._lock:
+            if codigos is None:
+                self._cache.clear()
+            for codigo in codigos or []:
+                self._cache.pop(_valor_bson(codigo), None)
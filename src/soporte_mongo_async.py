@@ -0,0 +1,254 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError, TimeoutError as FuturesTimeoutError
+
+from pymongo.server_api import ServerApi
+
+import src.soporte_mongo as sm
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+# Acceso asíncrono a MongoDB (Motor) para leer varias colecciones a la vez. Las corrutinas se
+# ejecutan en un bucle de eventos propio, en un hilo en segundo plano compartido por todo el
+# proceso; las funciones `*_sync` son la fachada para el código síncrono de Streamlit.
+TIMEOUT_CARGA = 120  # Segundos máximos de espera de la fachada síncrona
+
+_bucle = None
+_hilo_bucle = None
+_cliente = None
+_lock_bucle = threading.Lock()
+
+
+def get_bucle():
+    """
+    Devuelve el bucle de eventos compartido, arrancándolo la primera vez en un hilo en segundo plano.
+
+    Returns:
+        asyncio.AbstractEventLoop: Bucle de eventos.
+    """
+    global _bucle, _hilo_bucle
+    with _lock_bucle:
+        if _bucle is None:
+            _bucle = asyncio.new_event_loop()
+            _hilo_bucle = threading.Thread(target=_bucle.run_forever, name="mongo-async", daemon=True)
+            _hilo_bucle.start()
+    return _bucle
+
+
+def ejecutar(corrutina, timeout=TIMEOUT_CARGA):
+    """
+    Ejecuta una corrutina en el bucle compartido y espera su resultado desde código síncrono.
+
+    Args:
+        corrutina: Corrutina a ejecutar.
+        timeout (float): Segundos máximos de espera. Si se superan, la corrutina se cancela.
+
+    Returns:
+        Resultado de la corrutina.
+    """
+    futuro = asyncio.run_coroutine_threadsafe(corrutina, get_bucle())
+    try:
+        return futuro.result(timeout)
+    except FuturesTimeoutError:
+        futuro.cancel()
+        raise
+
+
+def get_cliente():
+    """
+    Devuelve el cliente de Motor del proceso, con el mismo pool y tiempos de espera que el cliente
+    síncrono de `soporte_mongo`. Solo debe usarse desde el bucle compartido.
+
+    Returns:
+        motor.motor_asyncio.AsyncIOMotorClient: Cliente asíncrono.
+    """
+    global _cliente
+    if AsyncIOMotorClient is None:
+        raise ImportError("motor no está instalado: usa las funciones síncronas de soporte_mongo")
+    if _cliente is None:
+        _cliente = AsyncIOMotorClient(
+            sm.mongo_uri,
+            server_api=ServerApi('1'),
+            maxPoolSize=sm.MAX_CONEXIONES,
+            serverSelectionTimeoutMS=sm.TIMEOUT_SELECCION_MS,
+            connectTimeoutMS=sm.TIMEOUT_CONEXION_MS,
+            socketTimeoutMS=sm.TIMEOUT_SOCKET_MS,
+            retryReads=True,
+            io_loop=get_bucle()
+        )
+    return _cliente
+
+
+async def iterar_documentos(nombre_bd, nombre_coleccion, filtro=None, proyeccion=None, tamanio_lote=1000):
+    """
+    Recorre una colección de forma asíncrona, documento a documento, leyendo el cursor por lotes.
+
+    Args:
+        nombre_bd (str): Nombre de la base de datos.
+        nombre_coleccion (str): Nombre de la colección.
+        filtro (dict, optional): Consulta que se aplica en el servidor.
+        proyeccion (dict, optional): Campos a devolver (proyección de `find()`).
+        tamanio_lote (int): Número de documentos por lote del cursor.
+
+    Yields:
+        dict: Documentos de la colección.
+    """
+    cursor = get_cliente()[nombre_bd][nombre_coleccion].find(filtro or {}, proyeccion).batch_size(tamanio_lote)
+    try:
+        async for documento in cursor:
+            yield documento
+    finally:
+        # También si se deja de leer a medias: el cursor no queda abierto en el servidor
+        await cursor.close()
+
+
+async def iterar_lotes(nombre_bd, nombre_coleccion, filtro=None, proyeccion=None, tamanio_lote=1000):
+    """
+    Recorre una colección de forma asíncrona por lotes de como máximo `tamanio_lote` documentos.
+
+    Yields:
+        list: Documentos de un lote.
+    """
+    documentos = iterar_documentos(nombre_bd, nombre_coleccion, filtro, proyeccion, tamanio_lote)
+    try:
+        lote = []
+        async for documento in documentos:
+            lote.append(documento)
+            if len(lote) >= tamanio_lote:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+    finally:
+        await documentos.aclose()
+
+
+class _LectorLotes:
+    """
+    Iterador síncrono de documentos sobre un generador asíncrono de lotes, para consumirlo desde un
+    hilo del executor: cada lote se pide al bucle cuando se necesita, así que solo hay uno en
+    memoria. `cerrar` (desde el bucle) impide pedir más lotes, espera al que esté en curso y solo
+    entonces cierra el generador, que no se puede cerrar mientras se está leyendo.
+    """
+
+    def __init__(self, lotes, bucle):
+        self.lotes = lotes
+        self.bucle = bucle
+        self._detenido = False
+        self._pendiente = None
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        while True:
+            with self._lock:
+                if self._detenido:
+                    return
+                self._pendiente = asyncio.run_coroutine_threadsafe(self.lotes.__anext__(), self.bucle)
+            try:
+                lote = self._pendiente.result()
+            except (StopAsyncIteration, CancelledError):
+                return
+            yield from lote
+
+    async def cerrar(self):
+        with self._lock:
+            self._detenido = True
+            pendiente = self._pendiente
+        if pendiente is not None and not pendiente.done():
+            await asyncio.wait([asyncio.wrap_future(pendiente)])
+        await self.lotes.aclose()
+
+
+async def obtener_marcador_version(nombre_bd, nombre_coleccion):
+    """
+    Versión asíncrona de `sm.obtener_marcador_version` (mismo formato). Las consultas se lanzan a la vez.
+
+    Returns:
+        str: Marcador de versión de la colección.
+    """
+    coleccion = get_cliente()[nombre_bd][nombre_coleccion]
+    n_documentos, ultimo, actualizado = await asyncio.gather(
+        coleccion.count_documents({}),
+        coleccion.find_one({}, {"_id": 1}, sort=[("_id", -1)]),
+        coleccion.find_one(
+            {sm.CAMPO_ACTUALIZACION: {"$exists": True}}, {"_id": 0, sm.CAMPO_ACTUALIZACION: 1},
+            sort=[(sm.CAMPO_ACTUALIZACION, -1)]
+        )
+    )
+    return sm.formatear_marcador_version(n_documentos, ultimo, actualizado)
+
+
+async def importar_con_snapshot(nombre_bd, nombre_coleccion, importador, construir, **kwargs):
+    """
+    Versión asíncrona de `sm.importar_con_snapshot`: usa la copia local si su versión coincide con la
+    de MongoDB y, si no, lee los documentos de forma asíncrona y construye la tabla. Comparte las
+    copias locales con la versión síncrona.
+
+    Args:
+        nombre_bd (str): Nombre de la base de datos.
+        nombre_coleccion (str): Nombre de la colección.
+        importador (callable): Importador síncrono equivalente; con sus argumentos identifica la copia local.
+        construir (callable): Función `construir(documentos)` que crea la tabla a partir de un iterable
+            de documentos. Se ejecuta en un hilo del executor mientras el cursor se lee por lotes, sin
+            reunir antes todos los documentos en una lista.
+        **kwargs: Argumentos del importador. 'filtro' y 'proyeccion' se aplican también en la consulta.
+
+    Returns:
+        pd.DataFrame | gpd.GeoDataFrame: Datos de la colección.
+    """
+    bucle = asyncio.get_running_loop()
+    # La lectura del disco no bloquea el bucle mientras se esperan las otras colecciones
+    df, version_local = await bucle.run_in_executor(None, sm.leer_snapshot, nombre_coleccion)
+
+    try:
+        marcador = await obtener_marcador_version(nombre_bd, nombre_coleccion)
+    except Exception as e:
+        if df is not None:
+            print(f"MongoDB no disponible, se usa la copia local de '{nombre_coleccion}': {e}")
+            return df
+        raise
+    version = sm.version_snapshot(marcador, importador, kwargs)
+    if df is not None and version_local == version:
+        return df
+
+    lector = _LectorLotes(
+        iterar_lotes(nombre_bd, nombre_coleccion, kwargs.get("filtro"), kwargs.get("proyeccion")), bucle
+    )
+    try:
+        df = await bucle.run_in_executor(None, construir, iter(lector))
+    finally:
+        # Cierra el cursor también si la construcción falla o la carga se cancela (timeout de
+        # `ejecutar`) mientras el hilo del executor aún está leyendo
+        await lector.cerrar()
+    if not df.empty:
+        await bucle.run_in_executor(None, sm.guardar_snapshot, df, nombre_coleccion, version)
+    return df
+
+
+async def importar_colecciones(nombre_bd, peticiones):
+    """
+    Importa varias colecciones a la vez: el tiempo total es el de la más lenta, no la suma.
+
+    Args:
+        nombre_bd (str): Nombre de la base de datos.
+        peticiones (dict): Por colección, una tupla (importador, construir, kwargs) como en `importar_con_snapshot`.
+
+    Returns:
+        dict: Tabla de cada colección.
+    """
+    nombres = list(peticiones)
+    tablas = await asyncio.gather(*(
+        importar_con_snapshot(nombre_bd, nombre, importador, construir, **kwargs)
+        for nombre, (importador, construir, kwargs) in peticiones.items()
+    ))
+    return dict(zip(nombres, tablas))
+
+
+def importar_colecciones_sync(nombre_bd, peticiones, timeout=TIMEOUT_CARGA):
+    """
+    Fachada síncrona de `importar_colecciones`, para llamarla desde Streamlit.
+    """
+    return ejecutar(importar_colecciones(nombre_bd, peticiones), timeout)
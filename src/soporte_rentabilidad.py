@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import numpy_financial as npf
 
@@ -44,12 +45,18 @@ def calcular_beneficio(precio_vivienda, ingresos_anuales, seguro_vida, intereses
     return beneficio
 
 
+# Las divisiones entre cero (p. ej. entrada del 0%) producen inf/NaN en lugar de avisos
+@np.errstate(divide="ignore", invalid="ignore")
 def calcular_rentabilidad_inmobiliaria(porcentaje_entrada, coste_compra, coste_reformas, comision_agencia, 
                                        alquiler_mensual, anios, tin, seguro_vida, tipo_irpf, 
                                        porcentaje_amortizacion):
     """
     Función para calcular las métricas de rentabilidad inmobiliaria basadas en los datos proporcionados.
 
+    Todos los parámetros aceptan tanto escalares como arrays de NumPy: las operaciones se
+    realizan con broadcasting, por lo que se puede evaluar una columna completa de viviendas
+    en una sola llamada.
+
     Parámetros:
     - porcentaje_entrada: Porcentaje del coste total cubierto por el pago inicial.
     - coste_compra: Coste total de la compra de la propiedad.
@@ -63,7 +70,7 @@ def calcular_rentabilidad_inmobiliaria(porcentaje_entrada, coste_compra, coste_r
     - porcentaje_amortizacion: Porcentaje anual aplicado para amortización.
 
     Devuelve:
-    - Diccionario con las métricas calculadas.
+    - Diccionario con las métricas calculadas (escalares o arrays, según la entrada).
     """
     # Cálculo del ITP (8%) y coste notario (2%)
     coste_itp = coste_compra * 0.08
@@ -143,20 +150,20 @@ def calcular_rentabilidad_inmobiliaria(porcentaje_entrada, coste_compra, coste_r
     # Resultados finales
     return {
         "Coste Total": coste_total,
-        "Rentabilidad Bruta": round(rentabilidad_bruta, 2),
-        "Beneficio Antes de Impuestos": round(beneficio_antes_impuestos,2),
-        "Rentabilidad Neta": round(rentabilidad_neta,2),
-        "Cuota Mensual Hipoteca": round(hipoteca_mensual,2),
-        "Cash Necesario Compra": round(cash_necesario_compra,2),
-        "Cash Total Compra y Reforma": round(cash_total_compra_reforma,2),
-        "Beneficio Neto": round(beneficio_neto,2),
-        "Rentabilidad Neta": round(rentabilidad_neta,2),
-        "Cashflow Antes de Impuestos": round(cashflow_antes_impuestos,2),
-        "Cashflow Después de Impuestos": round(cashflow_despues_impuestos,2),
-        "ROCE": round(roce,2),
-        "ROCE (Años)": round(roce_anios,2),
-        "Cash-on-Cash Return": round(cash_on_cash_return,2),
-        "COCR (Años)": round(cash_on_cash_return_anios,2)
+        "Rentabilidad Bruta": np.round(rentabilidad_bruta, 2),
+        "Beneficio Antes de Impuestos": np.round(beneficio_antes_impuestos, 2),
+        "Rentabilidad Neta": np.round(rentabilidad_neta, 2),
+        "Cuota Mensual Hipoteca": np.round(hipoteca_mensual, 2),
+        "Cash Necesario Compra": np.round(cash_necesario_compra, 2),
+        "Cash Total Compra y Reforma": np.round(cash_total_compra_reforma, 2),
+        "Beneficio Neto": np.round(beneficio_neto, 2),
+        "Rentabilidad Neta": np.round(rentabilidad_neta, 2),
+        "Cashflow Antes de Impuestos": np.round(cashflow_antes_impuestos, 2),
+        "Cashflow Después de Impuestos": np.round(cashflow_despues_impuestos, 2),
+        "ROCE": np.round(roce, 2),
+        "ROCE (Años)": np.round(roce_anios, 2),
+        "Cash-on-Cash Return": np.round(cash_on_cash_return, 2),
+        "COCR (Años)": np.round(cash_on_cash_return_anios, 2)
     }
 
 
@@ -180,34 +187,138 @@ def calcular_rentabilidad_inmobiliaria_wrapper(df, porcentaje_entrada, coste_ref
     Returns:
         pd.DataFrame: DataFrame con las métricas financieras calculadas añadidas.
     """
-    def calcular_rentabilidad_fila(row):
-        """
-        Calcula la rentabilidad para una fila del DataFrame.
-
-        Args:
-            row (pd.Series): Una fila del DataFrame.
-
-        Returns:
-            dict: Diccionario con las métricas financieras calculadas.
-        """
-        return calcular_rentabilidad_inmobiliaria(
-            porcentaje_entrada=porcentaje_entrada/100,
-            coste_compra=row['precio'],
-            coste_reformas=coste_reformas,
-            comision_agencia=comision_agencia/100,
-            alquiler_mensual=row['alquiler_predicho'],
-            anios=anios,
-            tin=tin/100,
-            seguro_vida=seguro_vida,
-            tipo_irpf=tipo_irpf/100,
-            porcentaje_amortizacion=porcentaje_amortizacion/100
-        )
-    
-    # Aplicar la función fila por fila y obtener un DataFrame con los resultados
-    df_resultados = df.apply(lambda row: pd.Series(calcular_rentabilidad_fila(row)), axis=1)
+    # Calcular todas las métricas de una vez sobre las columnas completas (sin iterar fila a fila)
+    metricas = calcular_rentabilidad_inmobiliaria(
+        porcentaje_entrada=porcentaje_entrada/100,
+        coste_compra=df['precio'].to_numpy(dtype=float),
+        coste_reformas=coste_reformas,
+        comision_agencia=comision_agencia/100,
+        alquiler_mensual=df['alquiler_predicho'].to_numpy(dtype=float),
+        anios=anios,
+        tin=tin/100,
+        seguro_vida=seguro_vida,
+        tipo_irpf=tipo_irpf/100,
+        porcentaje_amortizacion=porcentaje_amortizacion/100
+    )
+    df_resultados = pd.DataFrame(metricas, index=df.index)
     
     # Combinar el DataFrame original con los resultados
     df_final = pd.concat([df, df_resultados], axis=1)
     df_final.sort_values(by="Rentabilidad Bruta", ascending=False, inplace=True)
     
-    return df_final
\ No newline at end of file
+    return df_final
+
+# Orden de las métricas en la última dimensión del array de escenarios
+METRICAS = [
+    "Coste Total", "Rentabilidad Bruta", "Beneficio Antes de Impuestos", "Rentabilidad Neta",
+    "Cuota Mensual Hipoteca", "Cash Necesario Compra", "Cash Total Compra y Reforma", "Beneficio Neto",
+    "Cashflow Antes de Impuestos", "Cashflow Después de Impuestos", "ROCE", "ROCE (Años)",
+    "Cash-on-Cash Return", "COCR (Años)"
+]
+
+
+def calcular_rentabilidad_escenarios(df, porcentaje_entrada, coste_reformas, comision_agencia,
+                                     anios, tin, seguro_vida, tipo_irpf,
+                                     porcentaje_amortizacion, dtype=np.float64):
+    """
+    Evalúa la rentabilidad de todas las viviendas de un DataFrame para la rejilla cartesiana de
+    escenarios de compra y financiación, en una única pasada con broadcasting.
+
+    Cada parámetro acepta un escalar o una lista de valores, en las mismas unidades que
+    `calcular_rentabilidad_inmobiliaria_wrapper` (porcentajes sin dividir entre 100).
+
+    Args:
+        df (pd.DataFrame): DataFrame con las columnas 'precio' y 'alquiler_predicho'.
+        porcentaje_entrada (float | list): Porcentaje(s) de entrada para la hipoteca.
+        coste_reformas (float | list): Coste(s) total(es) de las reformas.
+        comision_agencia (float | list): Comisión(es) de la agencia.
+        anios (int | list): Duración(es) del préstamo hipotecario en años.
+        tin (float | list): Tasa(s) de interés nominal del préstamo hipotecario.
+        seguro_vida (float | list): Coste(s) anual(es) del seguro de vida.
+        tipo_irpf (float | list): Tipo(s) impositivo(s) del IRPF.
+        porcentaje_amortizacion (float | list): Porcentaje(s) de amortización aplicable(s).
+        dtype (np.dtype): Tipo del array de resultados (float32 reduce la memoria a la mitad).
+
+    Returns:
+        tuple[np.ndarray, pd.DataFrame]: Array de forma (viviendas, escenarios, métricas), con las
+        métricas en el orden de `METRICAS` y las viviendas en el orden de `df`, y un DataFrame
+        con los parámetros de cada escenario (una fila por escenario).
+    """
+    parametros = {
+        "porcentaje_entrada": porcentaje_entrada,
+        "coste_reformas": coste_reformas,
+        "comision_agencia": comision_agencia,
+        "anios": anios,
+        "tin": tin,
+        "seguro_vida": seguro_vida,
+        "tipo_irpf": tipo_irpf,
+        "porcentaje_amortizacion": porcentaje_amortizacion,
+    }
+
+    # Producto cartesiano de todos los valores: una columna por parámetro, una fila por escenario
+    rejilla = np.meshgrid(*[np.atleast_1d(np.asarray(v, dtype=float)) for v in parametros.values()], indexing="ij")
+    escenarios = pd.DataFrame({nombre: valores.ravel() for nombre, valores in zip(parametros, rejilla)})
+
+    # Viviendas en filas (N, 1) y escenarios en columnas (1, S)
+    def columna_escenario(nombre, escala=1):
+        return escenarios[nombre].to_numpy()[np.newaxis, :] / escala
+
+    metricas = calcular_rentabilidad_inmobiliaria(
+        porcentaje_entrada=columna_escenario("porcentaje_entrada", 100),
+        coste_compra=df['precio'].to_numpy(dtype=float)[:, np.newaxis],
+        coste_reformas=columna_escenario("coste_reformas"),
+        comision_agencia=columna_escenario("comision_agencia", 100),
+        alquiler_mensual=df['alquiler_predicho'].to_numpy(dtype=float)[:, np.newaxis],
+        anios=columna_escenario("anios"),
+        tin=columna_escenario("tin", 100),
+        seguro_vida=columna_escenario("seguro_vida"),
+        tipo_irpf=columna_escenario("tipo_irpf", 100),
+        porcentaje_amortizacion=columna_escenario("porcentaje_amortizacion", 100)
+    )
+
+    forma = (len(df), len(escenarios))
+    resultados = np.empty(forma + (len(METRICAS),), dtype=dtype)
+    for i, nombre in enumerate(METRICAS):
+        resultados[:, :, i] = np.broadcast_to(metricas[nombre], forma)
+
+    return resultados, escenarios
+
+
+
+def actualizar_rentabilidad_incremental(df_resultados, df_cambiados, codigos_eliminados, porcentaje_entrada,
+                                        coste_reformas, comision_agencia, anios, tin, seguro_vida, tipo_irpf,
+                                        porcentaje_amortizacion, clave="codigo"):
+    """
+    Actualiza un DataFrame de resultados de `calcular_rentabilidad_inmobiliaria_wrapper` recalculando solo
+    las viviendas insertadas o modificadas, y quitando las eliminadas.
+
+    Args:
+        df_resultados (pd.DataFrame): Resultados calculados previamente.
+        df_cambiados (pd.DataFrame): Viviendas insertadas o modificadas, sin métricas.
+        codigos_eliminados (iterable): Códigos de las viviendas eliminadas.
+        porcentaje_entrada (float): Porcentaje de entrada para la hipoteca.
+        coste_reformas (float): Coste total de las reformas.
+        comision_agencia (float): Comisión de la agencia.
+        anios (int): Duración del préstamo hipotecario en años.
+        tin (float): Tasa de interés nominal del préstamo hipotecario.
+        seguro_vida (float): Coste anual del seguro de vida.
+        tipo_irpf (float): Tipo impositivo del IRPF.
+        porcentaje_amortizacion (float): Porcentaje de amortización aplicable.
+        clave (str): Columna que identifica cada vivienda.
+
+    Returns:
+        pd.DataFrame: Resultados actualizados, ordenados por 'Rentabilidad Bruta' descendente.
+    """
+    codigos_quitados = set(codigos_eliminados)
+    partes = []
+    if not df_cambiados.empty:
+        codigos_quitados |= set(df_cambiados[clave])
+        partes.append(calcular_rentabilidad_inmobiliaria_wrapper(
+            df_cambiados, porcentaje_entrada, coste_reformas, comision_agencia, anios, tin,
+            seguro_vida, tipo_irpf, porcentaje_amortizacion
+        ))
+
+    df_final = pd.concat([df_resultados[~df_resultados[clave].isin(codigos_quitados)]] + partes)
+    df_final.sort_values(by="Rentabilidad Bruta", ascending=False, inplace=True)
+
+    return df_final
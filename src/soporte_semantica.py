@@ -0,0 +1,267 @@
+import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# Búsqueda semántica local sobre `descripcion`: sin llamadas de red al consultar.
+# Si `embedding_model` apunta a un modelo de sentence-transformers descargado, se usa ese modelo;
+# si no, vectores LSA (TF-IDF reducido con SVD) calculados solo con numpy.
+directorio_indice_semantico = os.getenv("semantic_index_dir", "indice_semantico")
+modelo_embeddings = os.getenv("embedding_model")
+
+DIMENSIONES_LSA = 128
+MAX_VOCABULARIO = 20000
+LONGITUD_RAIZ = 6  # Raíz aproximada: 'reformado', 'reformada' y 'reforma' comparten 'reform'
+
+_PALABRAS_VACIAS = set("""
+    a al algo algun alguna ante antes como con contra cual cuando de del desde donde durante e el
+    ella en entre es esta este esto estos hay la las le lo los mas me mi muy ni no nos o os para pero
+    por que se ser si sin sobre su sus tambien tiene tu un una unas uno unos y ya vivienda viviendas
+    piso pisos inmueble quiero busco buscando necesito
+""".split())
+
+_lock_modelo = threading.Lock()
+_modelo = None
+
+
+def _tokenizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [
+        token[:LONGITUD_RAIZ]
+        for token in re.findall(r"[a-z]{2,}", texto)
+        if token not in _PALABRAS_VACIAS
+    ]
+
+
+def _get_modelo():
+    # El modelo se carga una sola vez y solo desde disco (sin descargas)
+    global _modelo
+    with _lock_modelo:
+        if _modelo is None:
+            _modelo = SentenceTransformer(modelo_embeddings, local_files_only=True)
+    return _modelo
+
+
+def _usar_modelo():
+    return SentenceTransformer is not None and bool(modelo_embeddings)
+
+
+def _producto_disperso(filas, columnas, valores, matriz, n_salida):
+    # (matriz dispersa en formato COO) @ matriz densa, columna a columna con bincount
+    return np.column_stack([
+        np.bincount(filas, weights=valores * matriz[columnas, j], minlength=n_salida)
+        for j in range(matriz.shape[1])
+    ])
+
+
+def _ortonormalizar(matriz):
+    q, _ = np.linalg.qr(matriz)
+    return q
+
+
+def _calcular_lsa(textos, dimensiones=DIMENSIONES_LSA, semilla=0):
+    """
+    Vectores LSA de una lista de textos: TF-IDF (1 + log tf, idf suavizado) y SVD aleatorizada,
+    sin construir nunca la matriz TF-IDF densa.
+
+    Returns:
+        tuple: (vectores de los documentos, vocabulario, idf, proyección vocabulario -> dimensiones)
+    """
+    documentos = [_tokenizar(texto) for texto in textos]
+    n_documentos = len(documentos)
+    filas = np.repeat(np.arange(n_documentos), [len(d) for d in documentos])
+    tokens = pd.Series([token for documento in documentos for token in documento], dtype=object)
+
+    # Conteos por (documento, término) y frecuencia documental de cada término
+    conteos = pd.DataFrame({"fila": filas, "token": tokens}).value_counts().reset_index(name="tf")
+    frecuencia = conteos["token"].value_counts()
+    frecuencia = frecuencia[(frecuencia >= 2) & (frecuencia <= max(2, 0.5 * n_documentos))]
+    vocabulario = frecuencia.index[:MAX_VOCABULARIO].sort_values()
+    conteos = conteos[conteos["token"].isin(vocabulario)]
+
+    filas = conteos["fila"].to_numpy()
+    columnas = vocabulario.get_indexer(conteos["token"])
+    idf = (np.log((1 + n_documentos) / (1 + frecuencia.reindex(vocabulario).to_numpy())) + 1)
+    valores = (1 + np.log(conteos["tf"].to_numpy())) * idf[columnas]
+    normas = np.sqrt(np.bincount(filas, weights=valores ** 2, minlength=n_documentos))
+    valores = valores / normas[filas]
+
+    n_terminos = len(vocabulario)
+    if n_documentos < 2 or n_terminos < 2:
+        return np.zeros((n_documentos, 1)), list(vocabulario), idf, np.zeros((n_terminos, 1))
+
+    # SVD aleatorizada (Halko et al.) con dos iteraciones de potencia
+    dimensiones = max(1, min(dimensiones, n_documentos - 1, n_terminos - 1))
+    rng = np.random.default_rng(semilla)
+    y = _producto_disperso(filas, columnas, valores, rng.standard_normal((n_terminos, dimensiones + 10)), n_documentos)
+    q = _ortonormalizar(y)
+    for _ in range(2):
+        q = _ortonormalizar(_producto_disperso(columnas, filas, valores, q, n_terminos))
+        q = _ortonormalizar(_producto_disperso(filas, columnas, valores, q, n_documentos))
+    bt = _producto_disperso(columnas, filas, valores, q, n_terminos)  # (Q^T A)^T
+    v, _, _ = np.linalg.svd(bt, full_matrices=False)
+    proyeccion = v[:, :dimensiones]
+
+    vectores = _producto_disperso(filas, columnas, valores, proyeccion, n_documentos)
+    return vectores, list(vocabulario), idf, proyeccion
+
+
+def _normalizar_filas(matriz):
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    return np.divide(matriz, normas, out=np.zeros_like(matriz), where=normas > 0)
+
+
+class IndiceSemantico:
+    """
+    Vectores semánticos precalculados de las descripciones, guardados como matriz float32
+    normalizada y abierta con memory-map. La búsqueda de vecinos es exacta: un producto
+    matriz-vector y una selección parcial con argpartition.
+    """
+
+    def __init__(self, vectores, index, metodo, vocabulario=None, idf=None, proyeccion=None):
+        self.vectores = vectores
+        self.index = index
+        self.metodo = metodo
+        self.vocabulario = {token: i for i, token in enumerate(vocabulario or [])}
+        self.idf = idf
+        self.proyeccion = proyeccion
+        self._alineacion = (None, None)
+
+    def vectorizar(self, consulta):
+        """Vector normalizado de una consulta, en el mismo espacio que las descripciones."""
+        if self.metodo == "modelo":
+            vector = _get_modelo().encode([str(consulta)])[0].astype(np.float32)
+        else:
+            vector = np.zeros(self.proyeccion.shape[0])
+            for token in _tokenizar(consulta):
+                posicion = self.vocabulario.get(token)
+                if posicion is not None:
+                    vector[posicion] += 1
+            presentes = vector > 0
+            vector[presentes] = (1 + np.log(vector[presentes])) * self.idf[presentes]
+            vector = (vector @ self.proyeccion).astype(np.float32)
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma > 0 else vector
+
+    def similitudes(self, consulta, df=None):
+        """
+        Similitud coseno (recortada a [0, 1]) entre la consulta y cada descripción.
+
+        Args:
+            consulta (str): Texto libre.
+            df (pd.DataFrame, optional): Si se indica, las similitudes se devuelven en el orden de sus
+                filas (que pueden ser un subconjunto o una reordenación de las indexadas).
+
+        Returns:
+            np.ndarray: Similitudes por fila.
+        """
+        similitudes = np.clip(np.asarray(self.vectores @ self.vectorizar(consulta)), 0, 1)
+        if df is None or df.index is self.index:
+            return similitudes
+        # El índice se comparte entre sesiones: el par (índice, posiciones) se lee una sola vez y se
+        # sustituye entero, así que nunca se usan las posiciones calculadas para otro DataFrame
+        cacheada_index, alineacion = self._alineacion
+        if cacheada_index is not df.index:
+            alineacion = self.index.get_indexer(df.index)
+            self._alineacion = (df.index, alineacion)
+        return np.where(alineacion >= 0, similitudes[alineacion], 0.0)
+
+    def buscar(self, consulta, k=10):
+        """
+        Las k descripciones más parecidas a la consulta.
+
+        Returns:
+            pd.Series: Similitud de las k filas más parecidas (índice del DataFrame indexado), de mayor a menor.
+        """
+        similitudes = self.similitudes(consulta)
+        k = min(k, len(similitudes))
+        if k <= 0:
+            return pd.Series(dtype=np.float32)
+        mejores = np.argpartition(-similitudes, k - 1)[:k]
+        mejores = mejores[np.argsort(-similitudes[mejores])]
+        return pd.Series(similitudes[mejores], index=self.index[mejores])
+
+
+def _rutas_indice(clave):
+    base = os.path.join(directorio_indice_semantico, clave)
+    return f"{base}.npy", f"{base}.npz", f"{base}.json"
+
+
+def _borrar_indices_antiguos(clave):
+    # Cada versión de los textos genera un índice nuevo: solo se conserva el actual
+    for nombre in os.listdir(directorio_indice_semantico):
+        base, extension = os.path.splitext(nombre)
+        if base != clave and extension in (".npy", ".npz", ".json") and re.fullmatch(r"[0-9a-f]{24}", base):
+            try:
+                os.remove(os.path.join(directorio_indice_semantico, nombre))
+            except OSError as e:
+                print(f"No se pudo borrar el índice semántico antiguo '{nombre}': {e}")
+
+
+def construir_indice_semantico(df, columna="descripcion"):
+    """
+    Construye (o lee de disco si ya existe para estos textos) el índice semántico de un DataFrame.
+    Los vectores se guardan en `semantic_index_dir` y se abren con memory-map, así que no se
+    recalculan entre reinicios ni ocupan memoria propia en cada proceso.
+
+    Args:
+        df (pd.DataFrame): Viviendas, con etiquetas de índice únicas.
+        columna (str): Columna de texto a indexar.
+
+    Returns:
+        IndiceSemantico: El índice.
+    """
+    textos = df[columna].fillna("").astype(str).tolist() if columna in df.columns else [""] * len(df)
+    metodo = "modelo" if _usar_modelo() else "lsa"
+
+    # La clave depende de los textos y del método, no del orden de las filas ni de otras columnas
+    huella = hashlib.sha256()
+    huella.update(f"{metodo}|{modelo_embeddings}|{DIMENSIONES_LSA}|{LONGITUD_RAIZ}".encode("utf-8"))
+    for texto in textos:
+        huella.update(texto.encode("utf-8"))
+        huella.update(b"\0")
+    clave = huella.hexdigest()[:24]
+    ruta_vectores, ruta_modelo, ruta_metadatos = _rutas_indice(clave)
+
+    if os.path.exists(ruta_metadatos):
+        try:
+            vectores = np.load(ruta_vectores, mmap_mode="r")
+            if metodo == "modelo":
+                return IndiceSemantico(vectores, df.index, metodo)
+            with np.load(ruta_modelo, allow_pickle=False) as datos:
+                return IndiceSemantico(
+                    vectores, df.index, metodo, list(datos["vocabulario"]), datos["idf"], datos["proyeccion"]
+                )
+        except Exception as e:
+            print(f"No se pudo leer el índice semántico, se vuelve a calcular: {e}")
+
+    vocabulario, idf, proyeccion = None, None, None
+    if metodo == "modelo":
+        vectores = _get_modelo().encode(textos, batch_size=64, show_progress_bar=False)
+    else:
+        vectores, vocabulario, idf, proyeccion = _calcular_lsa(textos)
+    vectores = _normalizar_filas(np.asarray(vectores, dtype=np.float32))
+
+    try:
+        os.makedirs(directorio_indice_semantico, exist_ok=True)
+        np.save(ruta_vectores, vectores)
+        if metodo == "lsa":
+            np.savez(ruta_modelo, vocabulario=np.array(vocabulario), idf=idf, proyeccion=proyeccion)
+        # Los metadatos se escriben al final: un índice a medio escribir nunca se considera válido
+        with open(ruta_metadatos, "w", encoding="utf-8") as f:
+            json.dump({"metodo": metodo, "filas": len(textos), "dimensiones": int(vectores.shape[1])}, f)
+        vectores = np.load(ruta_vectores, mmap_mode="r")
+        _borrar_indices_antiguos(clave)
+    except OSError as e:
+        print(f"No se pudo guardar el índice semántico: {e}")
+    return IndiceSemantico(vectores, df.index, metodo, vocabulario, idf, proyeccion)